@@ -0,0 +1,155 @@
+import argparse
+import json
+import math
+import multiprocessing
+import signal
+import sys
+import time
+
+from bots import BOTS
+from game import GameState
+from headless import make_game
+from profiling import percentile
+from simulation import ScriptedInput
+
+# One game per worker process, made once and reused for every run that worker is handed
+_game = None
+
+
+def _init_worker():
+    global _game
+    _game = make_game()
+    # SDL turns SIGTERM into a quit event, which nothing reads here, so put the default back or the pool could never
+    # terminate its workers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def play(game, seed, bot, max_ticks):
+    # Plays one full run headlessly and returns its results. The run only depends on the seed, the bot and
+    # max_ticks, never on which process it ran in or what ran before it.
+    game.seed = seed
+    game.input = ScriptedInput(BOTS[bot](seed), game)
+    start = time.perf_counter()
+    game.new_game()
+    game.simulate(max_ticks)
+    elapsed = time.perf_counter() - start
+
+    if game.state == GameState.WIN:
+        outcome = 'won'
+    elif game.player.health <= 0:
+        outcome = 'died'
+    else:
+        outcome = 'timeout'
+
+    # Ticks spent on each level that was cleared
+    clear_ticks = [tick - previous for previous, tick in zip([0] + game.level_ticks, game.level_ticks)]
+    player = game.player
+    return {
+        'seed': seed,
+        'bot': bot,
+        'outcome': outcome,
+        'levels_cleared': len(game.level_ticks),
+        'level_ticks': clear_ticks,
+        'ticks': game.tick_count,
+        'seconds': game.tick_count / game.tick_rate,
+        'damage_taken': player.damage_taken,
+        'shots_fired': player.shots_fired,
+        'collectables': player.collectables_picked,
+        'health': player.health,
+        'wall_seconds': elapsed,
+    }
+
+
+def _run(task):
+    return play(_game, *task)
+
+
+def run_batch(runs, bot='hunter', seed=1, max_ticks=30 * 60 * 10, workers=None, on_result=None):
+    # Spreads the runs over a pool of worker processes, one per core by default. Each run has its own seed (seed,
+    # seed + 1, ...), so the results are the same however the runs end up shared between workers. on_result is
+    # called with each result as it comes back, in whatever order they finish.
+    tasks = [(seed + i, bot, max_ticks) for i in range(runs)]
+    results = []
+    with multiprocessing.Pool(workers or multiprocessing.cpu_count(), initializer=_init_worker) as pool:
+        for result in pool.imap_unordered(_run, tasks):
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+    results.sort(key=lambda result: result['seed'])
+    return results
+
+
+def describe(values):
+    if not values:
+        return None
+    return {
+        'mean': sum(values) / len(values),
+        'p10': percentile(values, 10),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'max': max(values),
+    }
+
+
+def aggregate(results):
+    outcomes = {}
+    for result in results:
+        outcomes[result['outcome']] = outcomes.get(result['outcome'], 0) + 1
+
+    levels = max((len(result['level_ticks']) for result in results), default=0)
+    return {
+        'runs': len(results),
+        'outcomes': outcomes,
+        'win_rate': outcomes.get('won', 0) / len(results) if results else 0.0,
+        # Only runs that cleared a level count towards how long that level takes
+        'level_ticks': [
+            describe([result['level_ticks'][level] for result in results if len(result['level_ticks']) > level])
+            for level in range(levels)
+        ],
+        'ticks': describe([result['ticks'] for result in results]),
+        'damage_taken': describe([result['damage_taken'] for result in results]),
+        'shots_fired': describe([result['shots_fired'] for result in results]),
+        'collectables': describe([result['collectables'] for result in results]),
+        'wall_seconds': sum(result['wall_seconds'] for result in results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play Crypto Crime Fighter headlessly many times over with a bot')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--bot', choices=sorted(BOTS), default='hunter')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the first run, the rest count up from it')
+    parser.add_argument('--max-ticks', type=int, default=30 * 60 * 10, help='give up on a run after this many ticks')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--output', help='write every run to this file as JSON lines, as they finish')
+    parser.add_argument('--summary', help='write the aggregated results to this JSON file')
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w') if args.output else None
+    done = [0]
+    start = time.perf_counter()
+
+    def on_result(result):
+        done[0] += 1
+        if out is not None:
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+        step = max(1, int(math.ceil(args.runs / 20)))
+        if done[0] % step == 0 or done[0] == args.runs:
+            print(f'{done[0]:>6}/{args.runs} runs  {time.perf_counter() - start:7.1f}s', file=sys.stderr)
+
+    try:
+        results = run_batch(args.runs, args.bot, args.seed, args.max_ticks, args.workers, on_result)
+    finally:
+        if out is not None:
+            out.close()
+
+    summary = aggregate(results)
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, 'w') as fh:
+            json.dump(summary, fh, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import pygame as pg
+
+from bots import ShooterBot
+from bullets import TARGET_ENEMY, TARGET_PLAYER
+from entities import Entity, Wall
+from headless import GAME_HEIGHT, GAME_WIDTH, TILE_SIZE, make_game
+from levels import Level
+from profiling import percentile
+from simulation import ScriptedInput
+from spatial import TileGrid
+
+# Each reported phase is the sum of these profiler scopes from Game.update_world and Game.game_loop
+PHASES = {
+    'update': ('bullets', 'regions', 'player', 'timers', 'swarm', 'update'),
+    'collisions': ('collisions',),
+    'draw': ('clear', 'draw'),
+    'display': ('display',),
+}
+
+# name: (wall density, enemies, collectables, bullets spawned per tick, level size in screens)
+SCENARIOS = {
+    'baseline': (0.05, 25, 10, 0, 1),
+    'dense_walls': (0.35, 25, 10, 0, 1),
+    'enemy_swarm': (0.05, 300, 10, 0, 1),
+    'bullet_storm': (0.05, 25, 10, 40, 1),
+    'everything': (0.25, 300, 50, 40, 1),
+    'horde': (0.05, 1000, 10, 0, 1),
+    'big_map': (0.05, 1000, 100, 0, 4),
+}
+
+
+def generate_level(path, wall_density=0.1, enemies=25, collectables=10, seed=1, scale=1):
+    # Writes a random level in the same CSV format as the shipped .level files: a solid border, walls scattered
+    # inside it, the player in the middle and enemies/collectables on free tiles. scale makes the level that many
+    # screens wide and high.
+    rng = random.Random(seed)
+    cols = GAME_WIDTH // TILE_SIZE * scale
+    rows = GAME_HEIGHT // TILE_SIZE * scale
+    grid = [['' for _ in range(cols)] for _ in range(rows)]
+    for col in range(cols):
+        grid[0][col] = grid[rows - 1][col] = 'W'
+    for row in range(rows):
+        grid[row][0] = grid[row][cols - 1] = 'W'
+
+    player = (cols // 2, rows // 2)
+    grid[player[1]][player[0]] = 'P'
+
+    free = [(c, r) for r in range(1, rows - 1) for c in range(1, cols - 1) if (c, r) != player]
+    rng.shuffle(free)
+    wall_count = int(len(free) * wall_density)
+    for col, row in free[:wall_count]:
+        grid[row][col] = 'W'
+    free = free[wall_count:]
+
+    # Every enemy and collectable gets a tile of its own, so the level has exactly as many as asked for
+    if enemies + collectables > len(free):
+        raise ValueError(
+            f'{enemies} enemies and {collectables} collectables need more than the {len(free)} free tiles at '
+            f'wall density {wall_density} and scale {scale}'
+        )
+    for col, row in free[:enemies]:
+        grid[row][col] = 'E'
+    for col, row in free[enemies:enemies + collectables]:
+        grid[row][col] = 'C'
+
+    with open(path, 'w') as fh:
+        for row in grid:
+            fh.write(','.join(row) + '\n')
+    return path
+
+
+def summarize(samples):
+    return {
+        'mean_ms': sum(samples) / len(samples) if samples else 0.0,
+        'p50_ms': percentile(samples, 50),
+        'p90_ms': percentile(samples, 90),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': max(samples) if samples else 0.0,
+    }
+
+
+def spawn_storm(game, rng, count):
+    for _ in range(count):
+        angle = rng.uniform(0, 2 * math.pi)
+        target = rng.choice((TARGET_ENEMY, TARGET_PLAYER))
+        game.bullets.spawn(
+            rng.randrange(TILE_SIZE, GAME_WIDTH - TILE_SIZE), rng.randrange(TILE_SIZE, GAME_HEIGHT - TILE_SIZE),
+            (math.cos(angle), math.sin(angle)), 6, 1, target
+        )
+
+
+def run_scenario(name, frames=600, seed=1, level_dir=None, batched_ai=False):
+    if level_dir is None:
+        with tempfile.TemporaryDirectory(prefix='ccf-bench-') as level_dir:
+            return run_scenario(name, frames, seed, level_dir, batched_ai)
+
+    wall_density, enemies, collectables, storm, scale = SCENARIOS[name]
+    path = generate_level(
+        os.path.join(level_dir, f'{name}.level'), wall_density, enemies, collectables, seed, scale
+    )
+
+    game = make_game(ScriptedInput(ShooterBot(seed)), seed)
+    game.batched_ai = batched_ai
+    # Generated levels are thrown away after the run, so there's no point caching them
+    game.new_game([Level(name, path, cache=False)])
+    # The player can't die during a benchmark, we want the full run every time
+    game.player.max_health = game.player.health = 10 ** 9
+    rng = random.Random(seed)
+
+    # Timed through the game's own profiler scopes. Splitting the update up by sprite class would time every sprite
+    # on its own, which costs more than some of what's being measured.
+    profiler = game.profiler
+    if not profiler.enabled:
+        profiler.toggle()
+    profiler.split_groups = False
+
+    window = game.window
+    timings = {phase: [] for phase in PHASES}
+    scopes = {}
+    frame_times = []
+    peak_bullets = 0
+
+    game.hud.draw(window, game.background, force=True)
+    game.bullets.candidate_pairs = 0
+    game.bullets.hit_pairs = 0
+    run_start = time.perf_counter()
+    for _ in range(frames):
+        if len(game.enemies) == 0:
+            break
+        if storm:
+            spawn_storm(game, rng, storm)
+
+        # A frame of Game.game_loop, with one tick per frame
+        profiler.begin_frame()
+        with profiler.scope('clear'):
+            game.clear_world()
+        game.update_world()
+        with profiler.scope('draw'):
+            changes = game.draw_world()
+            game.hud.update()
+            changes += game.hud.draw(window, game.background)
+        with profiler.scope('display'):
+            pg.display.update(changes)
+        profiler.end_frame()
+
+        current = profiler.current
+        for phase, names in PHASES.items():
+            timings[phase].append(sum(current.get(name, 0.0) for name in names))
+        for name, ms in current.items():
+            if name != 'frame':
+                scopes.setdefault(name, []).append(ms)
+        frame_times.append(current['frame'])
+        peak_bullets = max(peak_bullets, len(game.bullets))
+    elapsed = time.perf_counter() - run_start
+    pg.event.clear()
+
+    return {
+        'scenario': name,
+        'config': {
+            'wall_density': wall_density,
+            'enemies': enemies,
+            'collectables': collectables,
+            'storm_per_tick': storm,
+            'scale': scale,
+            'seed': seed,
+            'batched_ai': batched_ai,
+        },
+        'frames': len(frame_times),
+        'walls': game.wall_count,
+        'enemies_left': len(game.enemies),
+        'enemies_asleep': len(game.regions),
+        'peak_bullets': peak_bullets,
+        # Bullet and rect pairs that made it past the broad phase over the whole run, and how many of them hit
+        'candidate_pairs': game.bullets.candidate_pairs,
+        'hit_pairs': game.bullets.hit_pairs,
+        'fps': len(frame_times) / elapsed if elapsed else 0.0,
+        'frame': summarize(frame_times),
+        'phases': {phase: summarize(samples) for phase, samples in timings.items()},
+        'scopes': {name: summarize(samples) for name, samples in sorted(scopes.items())},
+    }
+
+
+def bench_wall_collisions(wall_counts=(0, 100, 250, 500, 1000), movers=50, frames=200, seed=1):
+    # Times Entity.move for a fixed number of movers while the number of walls on the level grows.
+    # With the tile index the time per frame should stay flat no matter how many walls there are.
+    game = make_game()
+    rng = random.Random(seed)
+    cols = GAME_WIDTH // TILE_SIZE
+    rows = GAME_HEIGHT // TILE_SIZE
+    all_tiles = [(c, r) for c in range(cols) for r in range(rows)]
+    mover_img = game.load_image('Enemy.png')
+
+    results = []
+    for wall_count in wall_counts:
+        game._init_groups()
+        game.wall_grid = TileGrid(GAME_WIDTH, GAME_HEIGHT, TILE_SIZE)
+        tiles = rng.sample(all_tiles, min(wall_count, len(all_tiles)))
+        for col, row in tiles:
+            Wall(game, col * TILE_SIZE, row * TILE_SIZE)
+
+        entities = []
+        for _ in range(movers):
+            rect = mover_img.get_rect(topleft=(rng.randrange(GAME_WIDTH), rng.randrange(GAME_HEIGHT)))
+            direction = (rng.choice([-1, 0, 1]), rng.choice([-1, 0, 1]))
+            entities.append((Entity(game, mover_img, rect, 3), direction))
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            for entity, direction in entities:
+                entity.move(direction[0], direction[1])
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'walls': len(tiles),
+            'movers': movers,
+            'frames': frames,
+            'ms_per_frame': elapsed * 1000 / frames,
+        })
+    return results
+
+
+def revision():
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(results, baseline):
+    # Prints how each scenario's mean and p99 frame time moved against an earlier results file
+    old = {run['scenario']: run for run in baseline.get('scenarios', [])}
+    for run in results['scenarios']:
+        before = old.get(run['scenario'])
+        if before is None:
+            continue
+        for stat in ('mean_ms', 'p99_ms'):
+            was = before['frame'][stat]
+            now = run['frame'][stat]
+            change = (now - was) / was * 100 if was else 0.0
+            print(f"{run['scenario']:>14} {stat:>8}: {was:8.3f} -> {now:8.3f} ms ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Crypto Crime Fighter performance benchmarks')
+    parser.add_argument('scenarios', nargs='*', help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results from an earlier run to compare against')
+    parser.add_argument('--batched-ai', action='store_true', help='run enemy AI through the vectorized swarm')
+    parser.add_argument('--skip-walls', action='store_true', help="don't run the wall scaling benchmark")
+    args = parser.parse_args(argv)
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario "{name}"')
+
+    results = {
+        'revision': revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pg.version.ver,
+        'scenarios': [],
+    }
+
+    for name in args.scenarios or SCENARIOS:
+        run = run_scenario(name, args.frames, args.seed, batched_ai=args.batched_ai)
+        results['scenarios'].append(run)
+        phases = ' '.join(f"{phase}={run['phases'][phase]['mean_ms']:.3f}" for phase in PHASES)
+        print(
+            f"{name:>14}: {run['fps']:8.1f} fps  p50={run['frame']['p50_ms']:.3f} p99={run['frame']['p99_ms']:.3f} ms"
+            f"  [{phases}]"
+        )
+
+    if not args.skip_walls:
+        results['wall_scaling'] = bench_wall_collisions(seed=args.seed)
+        for result in results['wall_scaling']:
+            print(f"walls={result['walls']:5d} movers={result['movers']} ms/frame={result['ms_per_frame']:.4f}")
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(results, json.load(fh))
+
+    pg.quit()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import random
+
+import pygame as pg
+
+from simulation import InputState
+
+ARROWS = (pg.K_LEFT, pg.K_RIGHT, pg.K_UP, pg.K_DOWN)
+
+
+def nearest_enemy(game):
+    best = None
+    target = None
+    px, py = game.player.rect.center
+    for enemy in game.enemies:
+        ex, ey = enemy.rect.center
+        distance = (ex - px) ** 2 + (ey - py) ** 2
+        if best is None or distance < best:
+            best = distance
+            target = (ex, ey)
+    return target
+
+
+class ShooterBot(object):
+    # Stands still, aims at the closest enemy and fires whenever it can. Like a real mouse, it aims on the screen.
+    def __init__(self, seed):
+        pass
+
+    def __call__(self, frame, game):
+        target = nearest_enemy(game) or (0, 0)
+        return InputState((), game.camera.to_screen(target), (True, False, False))
+
+
+class RandomBot(object):
+    # Mashes the arrow keys, waves the mouse around and fires at random. Each run gets its own seeded RNG so it plays
+    # the same way every time it's given the same seed.
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.keys = ()
+        self.aim = (0, 0)
+
+    def __call__(self, frame, game):
+        rng = self.rng
+        if frame % 15 == 0:
+            self.keys = tuple(key for key in ARROWS if rng.random() < 0.3)
+            self.aim = (rng.randrange(game.game_width), rng.randrange(game.game_height))
+        return InputState(self.keys, self.aim, (rng.random() < 0.5, False, False))
+
+
+class HunterBot(RandomBot):
+    # Wanders like RandomBot but always shoots at the closest enemy, which is usually enough to clear a level
+    def __call__(self, frame, game):
+        state = super().__call__(frame, game)
+        target = nearest_enemy(game)
+        if target is None:
+            return state
+        return InputState(state.keys, game.camera.to_screen(target), (True, False, False))
+
+
+BOTS = {
+    'shooter': ShooterBot,
+    'random': RandomBot,
+    'hunter': HunterBot,
+}
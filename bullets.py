@@ -0,0 +1,272 @@
+import numpy as np
+import pygame as pg
+
+from spatial import segment_entry
+
+
+def sweep_entry(x0, y0, dx, dy, left, top, right, bottom):
+    # segment_entry over arrays of segments and rects: how far along each segment (0 to 1) it enters the inside of
+    # its rect, or inf where it misses or only grazes an edge
+    t_enter = np.zeros(len(x0))
+    t_exit = np.ones(len(x0))
+    for p, d, low, high in ((x0, dx, left, right), (y0, dy, top, bottom)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_low = (low - p) / d
+            t_high = (high - p) / d
+        # Not moving along this axis means it's either always between the edges or never
+        inside = (p > low) & (p < high)
+        still = d == 0
+        t_enter = np.maximum(t_enter, np.where(still, np.where(inside, -np.inf, np.inf), np.minimum(t_low, t_high)))
+        t_exit = np.minimum(t_exit, np.where(still, np.where(inside, np.inf, -np.inf), np.maximum(t_low, t_high)))
+    return np.where(t_enter < t_exit, t_enter, np.inf)
+
+
+# Below this many bullet and rect pairs it's quicker to compare every bullet's box with every rect than to bin them
+BROAD_PHASE_PAIRS = 50000
+
+# Who a bullet can hurt
+TARGET_ENEMY = 0
+TARGET_PLAYER = 1
+
+
+class BulletManager(object):
+    # Every live bullet is a slot in a set of preallocated arrays rather than a Sprite. Dead slots go on a free list
+    # and get reused, and movement, culling and collision tests run over all bullets at once.
+    def __init__(self, game, capacity=256):
+        self.game = game
+        self.image = game.load_image('Bullet.png')
+        self.width, self.height = self.image.get_bounding_rect().size
+
+        self.capacity = 0
+        self.pos = np.zeros((0, 2), dtype=np.float64)
+        # Where each bullet was before its last move, collisions are tested along the whole path in between
+        self.prev = np.zeros((0, 2), dtype=np.float64)
+        self.vel = np.zeros((0, 2), dtype=np.float64)
+        self.damage = np.zeros(0, dtype=np.int32)
+        self.target = np.zeros(0, dtype=np.int8)
+        self.serial = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.free = []
+        self.next_serial = 0
+        self.count = 0
+
+        self.wall_grid = None
+        # Bullet and rect pairs given the exact test by reaching() and how many of them hit, since they were last reset
+        self.candidate_pairs = 0
+        self.hit_pairs = 0
+
+        # Rects drawn last frame, so they can be cleared and reported as dirty
+        self.drawn = []
+
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, capacity):
+        old = self.capacity
+        self.pos = np.resize(self.pos, (capacity, 2))
+        self.prev = np.resize(self.prev, (capacity, 2))
+        self.vel = np.resize(self.vel, (capacity, 2))
+        self.damage = np.resize(self.damage, capacity)
+        self.target = np.resize(self.target, capacity)
+        self.serial = np.resize(self.serial, capacity)
+        self.alive = np.resize(self.alive, capacity)
+        self.alive[old:] = False
+        # Hand out the lowest slots first
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def set_walls(self, grid):
+        self.wall_grid = grid
+
+    def spawn(self, x, y, direction, speed, damage, target):
+        if not self.free:
+            self._grow(self.capacity * 2)
+        slot = self.free.pop()
+        self.pos[slot] = (int(x), int(y))
+        self.prev[slot] = self.pos[slot]
+        self.vel[slot] = (direction[0] * speed, direction[1] * speed)
+        self.damage[slot] = damage
+        self.target[slot] = target
+        self.serial[slot] = self.next_serial
+        self.alive[slot] = True
+        self.next_serial += 1
+        self.count += 1
+        return slot
+
+    def kill(self, slots):
+        slots = np.asarray(slots, dtype=np.intp)
+        slots = slots[self.alive[slots]]
+        self.alive[slots] = False
+        self.free.extend(slots.tolist())
+        self.count -= len(slots)
+
+    def clear_all(self):
+        self.kill(np.flatnonzero(self.alive))
+
+    def active(self, target=None):
+        # Live slots in the order they were fired
+        mask = self.alive if target is None else self.alive & (self.target == target)
+        slots = np.flatnonzero(mask)
+        return slots[np.argsort(self.serial[slots], kind='stable')]
+
+    def bounds(self, slots):
+        left = np.floor(self.pos[slots, 0]).astype(np.int64)
+        top = np.floor(self.pos[slots, 1]).astype(np.int64)
+        return left, top, left + self.width, top + self.height
+
+    def update(self):
+        slots = np.flatnonzero(self.alive)
+        if not len(slots):
+            return
+        self.prev[slots] = self.pos[slots]
+        self.pos[slots] += self.vel[slots]
+
+    def cull(self):
+        # Kills the bullets that have left the level. Called once the collision tests are done, so a bullet that
+        # reaches a wall or an enemy on the move that takes it out still hits.
+        slots = np.flatnonzero(self.alive)
+        if not len(slots):
+            return
+        world = self.game.world_rect
+        left, top, right, bottom = self.bounds(slots)
+        outside = (left < world.left) | (top < world.top) | (right > world.right) | (bottom > world.bottom)
+        self.kill(slots[outside])
+
+    def sweep(self, slots):
+        # Each bullet's path over its last move as the top left corner's start point and offset, in whole pixels
+        # like bounds
+        start = np.floor(self.prev[slots]).astype(np.int64)
+        end = np.floor(self.pos[slots]).astype(np.int64)
+        return start[:, 0], start[:, 1], end[:, 0] - start[:, 0], end[:, 1] - start[:, 1]
+
+    def _near(self, bounds, left, top, right, bottom):
+        # The (rect, bullet) pairs whose boxes overlap, rect by rect and then in bullet order. With enough of them both
+        # get binned into the tiles of the wall grid they cover and only rects and bullets sharing a tile are compared.
+        # Nothing is ever found off the grid, where no enemy or player can be.
+        grid = self.wall_grid
+        if grid is None or len(bounds) * len(left) < BROAD_PHASE_PAIRS:
+            return np.nonzero(
+                (left < bounds[:, 2, None]) & (right > bounds[:, 0, None]) &
+                (top < bounds[:, 3, None]) & (bottom > bounds[:, 1, None])
+            )
+
+        rect_tiles, rect_spans = grid.span_cells(*grid.tile_spans(*bounds.T))
+        rect_spans = rect_spans[np.argsort(rect_tiles, kind='stable')]
+        # With the rects sorted by tile, the rects in each tile are one run starting at tile_start
+        tile_counts = np.bincount(rect_tiles, minlength=grid.rows * grid.cols)
+        tile_start = np.cumsum(tile_counts) - tile_counts
+        bullet_tiles, bullet_spans = grid.span_cells(*grid.tile_spans(left, top, right, bottom))
+        counts = tile_counts[bullet_tiles]
+        offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        rect_index = rect_spans[np.repeat(tile_start[bullet_tiles], counts) + offsets]
+        bullet_index = np.repeat(bullet_spans, counts)
+        # A pair sharing more than one tile only needs testing once, and np.unique puts them in order as well
+        pairs = np.unique(rect_index * len(left) + bullet_index)
+        rect_index = pairs // len(left)
+        bullet_index = pairs % len(left)
+
+        near = (
+            (left[bullet_index] < bounds[rect_index, 2]) & (right[bullet_index] > bounds[rect_index, 0]) &
+            (top[bullet_index] < bounds[rect_index, 3]) & (bottom[bullet_index] > bounds[rect_index, 1])
+        )
+        return rect_index[near], bullet_index[near]
+
+    def reaching(self, rects, slots, wall_entry):
+        # For each rect, the given slots (in the order given) that reached it during their last move without running
+        # into a wall first. Bullets are only checked against the rects near their swept box, and only the pairs
+        # whose boxes overlap get the exact test along the path. The number of pairs tested and hit are added to
+        # candidate_pairs and hit_pairs.
+        found = [slots[:0]] * len(rects)
+        if not len(rects) or not len(slots):
+            return found
+        x0, y0, dx, dy = self.sweep(slots)
+        bounds = np.array([(rect.left, rect.top, rect.right, rect.bottom) for rect in rects], dtype=np.int64)
+        rect_index, bullet_index = self._near(
+            bounds, np.minimum(x0, x0 + dx), np.minimum(y0, y0 + dy),
+            np.maximum(x0, x0 + dx) + self.width, np.maximum(y0, y0 + dy) + self.height
+        )
+        self.candidate_pairs += len(rect_index)
+        if not len(rect_index):
+            return found
+
+        # Grown by the bullet size so each bullet can be treated as the path of its top left corner
+        entry = sweep_entry(
+            x0[bullet_index], y0[bullet_index], dx[bullet_index], dy[bullet_index],
+            bounds[rect_index, 0] - self.width, bounds[rect_index, 1] - self.height,
+            bounds[rect_index, 2], bounds[rect_index, 3]
+        )
+        hit = np.isfinite(entry) & (entry <= wall_entry[slots[bullet_index]])
+        rect_index = rect_index[hit]
+        hit_slots = slots[bullet_index[hit]]
+        self.hit_pairs += len(rect_index)
+        # The pairs go rect by rect, so each rect's bullets are one run in slot order
+        splits = np.flatnonzero(np.diff(rect_index)) + 1
+        for run_rects, run_slots in zip(np.split(rect_index, splits), np.split(hit_slots, splits)):
+            if len(run_rects):
+                found[run_rects[0]] = run_slots
+        return found
+
+    def wall_entry(self):
+        # How far along its last move each live bullet first touched a wall, indexed by slot, inf if it didn't.
+        # Only bullets whose swept box has a wall tile in it get the exact test against the wall rects.
+        entry = np.full(self.capacity, np.inf)
+        if self.wall_grid is None:
+            return entry
+        slots = np.flatnonzero(self.alive)
+        if not len(slots):
+            return entry
+
+        grid = self.wall_grid
+        x0, y0, dx, dy = self.sweep(slots)
+        first_col, last_col, first_row, last_row = grid.tile_spans(
+            np.minimum(x0, x0 + dx), np.minimum(y0, y0 + dy),
+            np.maximum(x0, x0 + dx) + self.width, np.maximum(y0, y0 + dy) + self.height
+        )
+        candidates = np.flatnonzero(grid.spans_blocked(first_col, last_col, first_row, last_row))
+
+        cells = self.wall_grid.cells
+        for i in candidates.tolist():
+            x, y, vx, vy = int(x0[i]), int(y0[i]), int(dx[i]), int(dy[i])
+            best = None
+            seen = set()
+            for row in range(first_row[i], last_row[i] + 1):
+                for col in range(first_col[i], last_col[i] + 1):
+                    for rect in cells[row][col]:
+                        if id(rect) in seen:
+                            continue
+                        seen.add(id(rect))
+                        grown = pg.Rect(
+                            rect.left - self.width, rect.top - self.height,
+                            rect.width + self.width, rect.height + self.height
+                        )
+                        t = segment_entry(x, y, vx, vy, grown)
+                        if t is not None and (best is None or t < best):
+                            best = t
+            if best is not None:
+                entry[slots[i]] = best
+        return entry
+
+    def hit_walls(self, entry=None):
+        # Kills every bullet that ran into a wall during its last move
+        if entry is None:
+            entry = self.wall_entry()
+        self.kill(np.flatnonzero(np.isfinite(entry) & self.alive))
+
+    def draw(self, surface, view=None):
+        # view is the camera's rect in world coordinates, bullets outside it aren't drawn
+        slots = np.flatnonzero(self.alive)
+        left, top, right, bottom = self.bounds(slots)
+        if view is not None:
+            shown = (left < view.right) & (right > view.left) & (top < view.bottom) & (bottom > view.top)
+            left = left[shown] - view.x
+            top = top[shown] - view.y
+        image = self.image
+        rects = surface.blits([(image, (x, y)) for x, y in zip(left.tolist(), top.tolist())])
+        dirty = self.drawn + rects
+        self.drawn = rects
+        return dirty
+
+    def clear(self, surface, background):
+        surface.blits([(background, rect, rect) for rect in self.drawn], doreturn=False)
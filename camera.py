@@ -0,0 +1,27 @@
+import pygame as pg
+
+
+class Camera(object):
+    # The part of the level shown in the play area. Sprites, bullets and walls all live in world coordinates, and
+    # anything that's drawn or read from the mouse goes through the camera to get between the world and the screen.
+    def __init__(self, view_size, world_size):
+        self.view = pg.Rect((0, 0), view_size)
+        self.world = pg.Rect((0, 0), world_size)
+
+    @property
+    def offset(self):
+        return self.view.topleft
+
+    def follow(self, rect):
+        # Centres the view on rect, without ever showing anything past the edges of the world
+        self.view.center = rect.center
+        self.view.clamp_ip(self.world)
+
+    def to_screen(self, pos):
+        return (pos[0] - self.view.x, pos[1] - self.view.y)
+
+    def to_world(self, pos):
+        return (pos[0] + self.view.x, pos[1] + self.view.y)
+
+    def visible(self, rect):
+        return self.view.colliderect(rect)
@@ -1,8 +1,10 @@
 import math
-import random
 
 import pygame as pg
 
+from bullets import TARGET_ENEMY, TARGET_PLAYER
+from resources import RotationAtlas
+
 PLAYERDEADEVENT = pg.USEREVENT + 1
 
 class Entity(pg.sprite.Sprite):
@@ -21,25 +23,22 @@ class Entity(pg.sprite.Sprite):
         self.game.window.blit(self.image, self.rect)
 
     def move(self, x, y):
-        # If this is a bullet we actually want it to collide and get destroyed 
-        if isinstance(self, Bullet):
-            self.rect.x += x * self.speed
-            self.rect.y += y * self.speed
-            return
-
         starting_x = self.rect.x
         starting_y = self.rect.y
 
+        # Walls are static, so we only have to check the tiles our rect overlaps rather than every wall
+        wall_grid = self.game.wall_grid
+
         # Calculate our x position
         vx = x * self.speed
         self.rect.x += vx
-        if pg.sprite.spritecollide(self, self.game.walls, False):
+        if wall_grid.collides(self.rect):
             self.rect.x = starting_x
 
         # Calculate our y position
         vy = y * self.speed
         self.rect.y += vy
-        if pg.sprite.spritecollide(self, self.game.walls, False):
+        if wall_grid.collides(self.rect):
             self.rect.y = starting_y
 
     def remove(self):
@@ -60,14 +59,25 @@ class Player(Entity):
         )
 
         self.original_image = self.image
+        # Facing the mouse only needs one of a fixed set of angles, so the rotated frames are kept rather than redone
+        self.rotations = RotationAtlas(
+            {'normal': self.original_image, 'hit': self.hit_img},
+            buckets=game.rotation_buckets,
+            budget=game.rotation_budget
+        )
         self.can_shoot = True
         self.shot_timer = 0.2
         self.last_shot = -1
         self.score = 0
+        # Totals for the whole run, read by the batch runner
+        self.shots_fired = 0
+        self.damage_taken = 0
+        self.collectables_picked = 0
 
         self.max_health = 100
         self.health = self.max_health
         self.damage = 5
+        self.bullet_speed = 20
 
         self.hit_state = False
         self.hit_state_start = 0
@@ -77,18 +87,15 @@ class Player(Entity):
         center_x = self.rect.center[0]
         center_y = self.rect.center[1]
 
-        # Rotate the sprite to face the mouse
-        mouse_x, mouse_y = pg.mouse.get_pos()
+        # Rotate the sprite to face the mouse. The mouse is on the screen and the player is in the world.
+        mouse_x, mouse_y = self.game.camera.to_world(self.game.input.get_mouse_pos())
         rel_x = mouse_x - center_x
         rel_y = mouse_y - center_y
         rotation = ((180 / math.pi) * -math.atan2(rel_y, rel_x)) -90
         self.rotation = rotation
 
         original_center = self.rect.center
-        if not self.hit_state:
-            self.image = pg.transform.rotate(self.original_image, rotation)
-        else:
-            self.image = pg.transform.rotate(self.hit_img, rotation)
+        self.image = self.rotations.get('hit' if self.hit_state else 'normal', rotation)
         self.rect = self.image.get_rect(center=original_center)
 
         # Calculate where bullets should spawn so that they appear to come out of the gun barrel
@@ -105,18 +112,16 @@ class Player(Entity):
 
     def _take_action(self):
         # Move the player
-        keystate = pg.key.get_pressed()
+        keystate = self.game.input.get_pressed()
         x_dir = keystate[pg.K_RIGHT] - keystate[pg.K_LEFT]
         y_dir = keystate[pg.K_DOWN] - keystate[pg.K_UP]
 
         self.move(x_dir, y_dir)
 
         # Shoot
-        click, _, _ = pg.mouse.get_pressed()
+        click, _, _ = self.game.input.get_mouse_pressed()
         if click and self.can_shoot and not self.hit_state:
-            self.can_shoot = False
-            self.last_shot = pg.time.get_ticks()
-            m_pos = pg.mouse.get_pos()
+            m_pos = self.game.camera.to_world(self.game.input.get_mouse_pos())
             #
             # TODO: I really need to fix the shooting because the bullets are all over the damn place
             #
@@ -130,9 +135,15 @@ class Player(Entity):
 
 
             b_vec = m_vec - p_vec
+            # With the mouse right on the player there's no direction to shoot in
+            if b_vec.length_squared() == 0:
+                return
             b_vec.normalize_ip()
 
-            Bullet(self.game, p_vec.x, p_vec.y, b_vec, Enemy, damage=self.damage)
+            self.can_shoot = False
+            self.last_shot = self.game.clock.get_ticks()
+            self.game.bullets.spawn(p_vec.x, p_vec.y, b_vec, self.bullet_speed, self.damage, TARGET_ENEMY)
+            self.shots_fired += 1
 
     def take_hit(self, damage):
         # We don't take damage while we're in a hit state
@@ -140,24 +151,26 @@ class Player(Entity):
             return
 
         self.health -= damage
+        self.damage_taken += damage
 
         if self.health <= 0:
             pg.event.post(pg.event.Event(PLAYERDEADEVENT))
             return
         else:
             self.hit_state = True
-            self.hit_state_start = pg.time.get_ticks()
+            self.hit_state_start = self.game.clock.get_ticks()
 
     def heal(self, add_health):
         self.health = min(self.health + add_health, self.max_health)
 
     def update(self):
+        # The player updates before any timers run, so its hit state is checked here rather than scheduled
         if self.hit_state:
-            if pg.time.get_ticks() >= self.hit_state_start + self.hit_state_duration:
+            if self.game.clock.get_ticks() >= self.hit_state_start + self.hit_state_duration:
                 self.hit_state = False
 
         if not self.can_shoot:
-            now = pg.time.get_ticks()
+            now = self.game.clock.get_ticks()
             if now - self.last_shot >= self.shot_timer * 1000:
                 self.can_shoot = True
         self._rotate()
@@ -181,41 +194,54 @@ class Enemy(Entity):
         self.health = 15
         self.melee_dmg = 5
         self.speed = 3
+        self.bullet_speed = 5
+        self.bullet_damage = 5
 
         self.hit_state = False
         self.hit_state_start = 0
         self.hit_state_duration = 500
 
-        self.last_action = pg.time.get_ticks()
-        self.action_timer = random.randint(750, 1500)
+        self.last_action = game.clock.get_ticks()
+        self.action_timer = game.rng.randint(750, 1500)
+        self.hit_state_end = None
+        self.end_hit = None
         self.rand_action_chance = 0.25
         self.rand_moving = False
         self.move_dir = (0, 0)
+        # Once an enemy has seen the player it follows the level's flow field, which takes it around walls
+        self.chasing = False
         self.attack_range = 300
         self.sight_range = 500
 
         super().__init__(game, img, rect, self.speed)
         self.game.enemies.add(self)
+        # Enemies far from the player are put to sleep by the game's region map, see sleep() and wake()
+        self.asleep = False
+
+        # With batched AI the swarm decides and moves for this enemy, and the sprite is only drawn and collided with.
+        # Otherwise it's updated with the active group, and decisions are made when the game's scheduler fires _act
+        # rather than by checking the time every tick.
+        self.slot = None
+        self.next_action = None
+        if game.swarm is not None:
+            self.slot = game.swarm.add(self)
+        else:
+            self.game.active.add(self)
+            self.next_action = game.scheduler.schedule(self.last_action + self.action_timer, self._act)
 
     def _player_in_range(self, distance):
-        myvec = pg.Vector2(self.rect.center)
-        playervec = pg.Vector2(self.game.player.rect.center)
-
-        # This seems like a really expensive way to check if there's a wall between the enemy and the player, 
-        # but I couldn't figure a better way to do it.
-        distance_to_player = myvec.distance_to(playervec)
-        if distance_to_player <= distance:
-            walls = [w.rect for w in self.game.walls.sprites()]
-            # Check every 10 pixels for a wall
-            chk_count = int(distance_to_player / 10)
-            interval = 1 / chk_count
-            for itr in range(1, chk_count - 1):
-                point = myvec.lerp(playervec, interval * itr)
-                for wall in walls:
-                    if wall.collidepoint(point.x, point.y):
-                        return False
-            return True
-        return False
+        return self._player_visible(distance, self._distance_to_player())
+
+    def _distance_to_player(self):
+        return pg.Vector2(self.rect.center).distance_to(self.game.player.rect.center)
+
+    def _player_visible(self, distance, distance_to_player):
+        if distance_to_player > distance:
+            return False
+        return self.game.visibility.can_see(self.rect.center, self.game.player.rect.center)
+
+    def _path_to_player(self):
+        return self.game.flow_field.path_length(self.rect.center, self.game.player.rect.center)
 
     def _vec_to_player(self):
         e_vec = pg.Vector2(self.rect.center)
@@ -223,45 +249,64 @@ class Enemy(Entity):
         d_vec = p_vec - e_vec
         return d_vec.normalize()
 
-    def update(self):
-        if self.hit_state == True:
-            self.image = self.hit_img
-
-            if pg.time.get_ticks() >= self.hit_state_start + self.hit_state_duration:
-                self.hit_state = False
-                self.image = self.orig_img
+    def _act(self):
+        now = self.game.clock.get_ticks()
 
-            # If the enemy is currently hit, it will not take any actions.
+        # If the enemy is currently hit, it will not take any actions until it recovers
+        if self.hit_state:
+            self.next_action = self.game.scheduler.schedule(self.hit_state_end, self._act)
             return
 
-        now = pg.time.get_ticks()
-        if now >= self.last_action + self.action_timer:
+        self.last_action = now
+        self.next_action = self.game.scheduler.schedule(now + self.action_timer, self._act)
+
+        # The attack range is inside the sight range, so a single line of sight check covers both
+        distance_to_player = self._distance_to_player()
+        player_visible = self._player_visible(self.sight_range, distance_to_player)
+        if player_visible and distance_to_player <= self.attack_range:
+            self.rand_moving = False
+            self.chasing = False
+            b_vec = self._vec_to_player()
+            self.game.bullets.spawn(
+                self.rect.center[0], self.rect.center[1], b_vec, self.bullet_speed, self.bullet_damage, TARGET_PLAYER
+            )
+
+            self.last_action = now
+        elif player_visible:
+            self.rand_moving = True
+            self.chasing = True
+
             self.last_action = now
-            if self._player_in_range(self.attack_range):
-                self.rand_moving = False
-                b_vec = self._vec_to_player()
-                EnemyBullet(self.game, self.rect.center[0], self.rect.center[1], b_vec)
-
-                self.last_action = now
-            elif self._player_in_range(self.sight_range):
-                self.rand_moving = True
-                m_vec = self._vec_to_player()
-                self.move_dir = (m_vec.x, m_vec.y)
-
-                self.last_action = now
-            else:
+        else:
+            # If the player went out of sight but is still close by walking distance, keep after them
+            if self.chasing:
+                path = self._path_to_player()
+                if path is None or path > self.sight_range:
+                    self.chasing = False
+
+            # Chasing enemies are steered by the flow field, the rest wander at random
+            if not self.chasing:
                 # If we aren't moving and the player isn't in range, lets see about maybe moving randomly
                 if not self.rand_moving:
-                    if random.random() >= self.rand_action_chance:
+                    if self.game.rng.random() >= self.rand_action_chance:
                         self.rand_moving = True
-                        newx = random.choice([-1, 0, 1])
-                        newy = random.choice([-1, 0, 1])
+                        newx = self.game.rng.choice([-1, 0, 1])
+                        newy = self.game.rng.choice([-1, 0, 1])
                         self.move_dir = (newx, newy)
 
                 # If we're already moving and our action timer is expired, lets see if we should stop moving for a bit
-                elif self.rand_moving:
-                    if random.random() < self.rand_action_chance:
-                        self.rand_moving = False
+                elif self.game.rng.random() < self.rand_action_chance:
+                    self.rand_moving = False
+
+    def update(self):
+        # If the enemy is currently hit, it will not take any actions.
+        if self.hit_state:
+            return
+
+        # Chasing enemies pick their direction from the flow field every tick. If they lose the player they carry on
+        # in the last direction they were heading.
+        if self.chasing:
+            self.move_dir = self.game.flow_field.steer(self.rect.center, self.game.player.rect.center)
 
         # If the enemy is already moving, keep on moving. We only change their movement behavior on the action timer
         if self.rand_moving:
@@ -271,7 +316,17 @@ class Enemy(Entity):
         # We don't take damage while we're in a hit state
         if self.hit_state:
             return
-            
+
+        # Getting shot from out of range wakes an enemy up, and it comes after the player until its next decision.
+        # Being hit or chasing keeps it awake outside the active area.
+        if self.asleep:
+            self.game.regions.wake(self)
+            self.rand_moving = True
+            self.chasing = True
+            if self.slot is not None:
+                self.game.swarm.rand_moving[self.slot] = True
+                self.game.swarm.chasing[self.slot] = True
+
         self.health -= damage
 
         if self.health <= 0:
@@ -279,41 +334,59 @@ class Enemy(Entity):
             self.remove()
         else:
             self.hit_state = True
-            self.hit_state_start = pg.time.get_ticks()
-
-    def drop_loot(self):
-        if random.random() <= self.reward_chance:
-            self.reward(self.game, self.rect.x, self.rect.y)
-
-
-class Bullet(Entity):
-    def __init__(self, game, x, y, direction, target, damage=5):
-        img = game.load_image('Bullet.png')
-        b_rect = img.get_bounding_rect()
-        b_rect.x = x
-        b_rect.y = y
-        super().__init__(game, game.load_image('Bullet.png'), b_rect, 20)
-        self.game.bullets.add(self)
-        self.direction = direction
-        self.damage = damage
-        self.target = target
-
-    def update(self):
-        self.move(self.direction.x, self.direction.y)
-        #raise Exception()
-
-        if not self.game.screen_rect.contains(self.rect):
-            self.remove()
+            self.hit_state_start = self.game.clock.get_ticks()
+            self.hit_state_end = self.hit_state_start + self.hit_state_duration
+            self.image = self.hit_img
+            self.end_hit = self.game.scheduler.schedule(self.hit_state_end, self._end_hit_state)
+            if self.slot is not None:
+                self.game.swarm.hit[self.slot] = True
 
+    def _end_hit_state(self):
+        self.hit_state = False
+        self.image = self.orig_img
+        if self.slot is not None:
+            self.game.swarm.hit[self.slot] = False
+
+    def sleep(self):
+        # Stops updating and cancels the next decision. The hit state timer is left to run out on its own.
+        self.asleep = True
+        self.game.active.remove(self)
+        if self.next_action is not None:
+            self.next_action.cancel()
+            self.next_action = None
+        if self.slot is not None:
+            self.game.swarm.asleep[self.slot] = True
+
+    def wake(self):
+        # Picks up as if the enemy had just been spawned, with a full action timer to go before its next decision
+        self.asleep = False
+        self.last_action = self.game.clock.get_ticks()
+        if self.slot is not None:
+            self.game.swarm.asleep[self.slot] = False
+            self.game.swarm.next_action[self.slot] = self.last_action + self.action_timer
+        else:
+            self.game.active.add(self)
+            self.next_action = self.game.scheduler.schedule(self.last_action + self.action_timer, self._act)
 
-class EnemyBullet(Bullet):
-    def __init__(self, game, x, y, direction):
-        super().__init__(game, x, y, direction, Player)
+    def remove(self):
+        # Dead enemies must not be woken up again
+        if self.next_action is not None:
+            self.next_action.cancel()
+        if self.hit_state:
+            self.end_hit.cancel()
+        if self.slot is not None:
+            self.game.swarm.remove(self.slot)
+            self.slot = None
+        super().remove()
 
-        self.speed = 5
+    def drop_loot(self):
+        if self.game.rng.random() <= self.reward_chance:
+            self.reward(self.game, self.rect.x, self.rect.y)
 
 
 class Wall(pg.sprite.Sprite):
+    # A single wall tile added to the wall grid. Levels don't use these, their walls are drawn into the tilemap and
+    # registered with the wall grid as merged colliders when the level is prepared.
     def __init__(self, game, x, y):
         super().__init__()
 
@@ -323,8 +396,7 @@ class Wall(pg.sprite.Sprite):
         self.rect.x = x
         self.rect.y = y
 
-        self.game.walls.add(self)
-        self.game.entities.add(self)
+        self.game.wall_grid.add(self.rect)
 
 
 class Collectable(pg.sprite.Sprite):
@@ -338,7 +410,7 @@ class Collectable(pg.sprite.Sprite):
         self.rect.y = y
 
         self.reward_health = 20
-        self.reward_damage = random.choice([0, 1])
+        self.reward_damage = self.game.rng.choice([0, 1])
 
         self.game.collectables.add(self)
         self.game.entities.add(self)
@@ -0,0 +1,216 @@
+import math
+import random
+
+import numpy as np
+import pygame as pg
+
+from bullets import TARGET_PLAYER
+from game import GameState
+from headless import make_game
+from simulation import InputState, ScriptedInput
+
+# (move x, move y, aim x, aim y, fire). Moves are -1, 0 or 1 along each axis and anything above 0.5 fires. The aim
+# is a direction of any length: the mouse goes AIM_DISTANCE pixels from the centre of the player along it, and an aim
+# of (0, 0) keeps the last direction.
+ACTION_SIZE = 5
+AIM_DISTANCE = 100
+
+
+class GameEnv(object):
+    # Gym-style wrapper around a headless Game for training bots: reset() starts a new game and step(action) plays
+    # frame_skip ticks with that action held down. Observations are a dict of NumPy arrays, all in screen coordinates
+    # (relative to the camera view) so they have the same shape on every level:
+    #   tiles    (view rows, view cols) uint8, 1 where there's a wall
+    #   player   (4,) float32, x, y, health and damage
+    #   enemies  (max_enemies, 3) float32, x, y and 1 for each enemy, closest first, zero padded
+    #   bullets  (max_bullets, 5) float32, x, y, vx, vy and who it's aimed at: 1 for enemies, 2 for the player.
+    #            Closest first, zero padded.
+    # The reward is one per enemy killed and ten per level cleared, minus a tenth per point of damage taken.
+    def __init__(self, seed=None, levels=None, frame_skip=1, max_ticks=30 * 60 * 10, max_enemies=32, max_bullets=64,
+                 frame_size=None, batched_ai=False):
+        # Every episode gets a seed drawn from this, so a seeded env plays the same episodes in the same order
+        self.seeds = random.Random(seed)
+        self.levels = levels
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        self.max_enemies = max_enemies
+        self.max_bullets = max_bullets
+        # Size of the frames render() returns, the play area's own size if None
+        self.frame_size = frame_size
+
+        self.state = InputState()
+        self.aim = (0.0, -1.0)
+        self.game = make_game(ScriptedInput(self._input))
+        self.game.batched_ai = batched_ai
+        ts = self.game.tile_size
+        self.view_tiles = (self.game.game_height // ts, self.game.game_width // ts)
+
+    def _input(self, frame, game):
+        return self.state
+
+    def _set_action(self, action):
+        move_x, move_y, aim_x, aim_y, fire = (float(value) for value in action)
+        keys = []
+        if move_x < 0:
+            keys.append(pg.K_LEFT)
+        elif move_x > 0:
+            keys.append(pg.K_RIGHT)
+        if move_y < 0:
+            keys.append(pg.K_UP)
+        elif move_y > 0:
+            keys.append(pg.K_DOWN)
+        length = math.hypot(aim_x, aim_y)
+        if length > 0:
+            self.aim = (aim_x / length, aim_y / length)
+        x, y = self.game.camera.to_screen(self.game.player.rect.center)
+        mouse = (int(x + self.aim[0] * AIM_DISTANCE), int(y + self.aim[1] * AIM_DISTANCE))
+        self.state = InputState(keys, mouse, (fire > 0.5, False, False))
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seeds.seed(seed)
+        game = self.game
+        game.seed = self.seeds.getrandbits(32)
+        self.state = InputState()
+        self.aim = (0.0, -1.0)
+        game.new_game(self.levels)
+        pg.event.clear()
+        return self.observe(), {'seed': game.seed}
+
+    def step(self, action):
+        game = self.game
+        player = game.player
+        self._set_action(action)
+        damage_taken = player.damage_taken
+        reward = 0.0
+        terminated = False
+
+        for _ in range(self.frame_skip):
+            enemies = len(game.enemies)
+            cleared = len(game.level_ticks)
+            playing = game.step_tick()
+            if len(game.level_ticks) > cleared:
+                # Every enemy that was left died, and the next level (if there is one) has already started
+                reward += enemies + 10
+            else:
+                reward += enemies - len(game.enemies)
+            if not playing:
+                terminated = True
+                break
+
+        reward -= (player.damage_taken - damage_taken) / 10
+        truncated = not terminated and game.tick_count >= self.max_ticks
+        info = {
+            'ticks': game.tick_count,
+            'level': game.level_manager.current_level,
+            'won': game.state == GameState.WIN,
+        }
+        return self.observe(), reward, terminated, truncated, info
+
+    def _closest(self, positions, count):
+        # Indices of the count positions closest to the player
+        offset = positions - np.asarray(self.game.player.rect.center, dtype=np.float64)
+        order = np.argsort(offset[:, 0] ** 2 + offset[:, 1] ** 2, kind='stable')
+        return order[:count]
+
+    def observe(self):
+        game = self.game
+        view = game.camera.view
+        ts = game.tile_size
+
+        rows, cols = self.view_tiles
+        tiles = np.zeros((rows, cols), dtype=np.uint8)
+        wall_tiles = game.wall_grid.blocked_tiles()
+        # The view doesn't have to line up with the tiles, so this is the tile grid under its top left corner
+        row = min(view.top // ts, wall_tiles.shape[0] - rows)
+        col = min(view.left // ts, wall_tiles.shape[1] - cols)
+        tiles[:] = wall_tiles[row:row + rows, col:col + cols]
+
+        player = game.player
+        x, y = game.camera.to_screen(player.rect.center)
+        player_obs = np.array([x, y, player.health, player.damage], dtype=np.float32)
+
+        enemies = np.zeros((self.max_enemies, 3), dtype=np.float32)
+        if len(game.enemies):
+            centers = np.array([enemy.rect.center for enemy in game.enemies], dtype=np.float64)
+            centers = centers[self._closest(centers, self.max_enemies)]
+            enemies[:len(centers), :2] = centers - view.topleft
+            enemies[:len(centers), 2] = 1
+
+        bullets = np.zeros((self.max_bullets, 5), dtype=np.float32)
+        manager = game.bullets
+        slots = manager.active()
+        if len(slots):
+            centers = manager.pos[slots] + (manager.width / 2, manager.height / 2)
+            closest = self._closest(centers, self.max_bullets)
+            slots = slots[closest]
+            count = len(slots)
+            bullets[:count, :2] = centers[closest] - view.topleft
+            bullets[:count, 2:4] = manager.vel[slots]
+            bullets[:count, 4] = np.where(manager.target[slots] == TARGET_PLAYER, 2, 1)
+
+        return {'tiles': tiles, 'player': player_obs, 'enemies': enemies, 'bullets': bullets}
+
+    def render(self):
+        # Draws the play area from scratch into the game's off-screen window and returns it as a (height, width, 3)
+        # uint8 array
+        game = self.game
+        game.refresh_background()
+        game.window.blit(game.background, game.game_rect, game.game_rect)
+        game.entity_layer.draw(game.view_surface, game.entities)
+        game.bullets.draw(game.view_surface, game.camera.view)
+        frame = game.view_surface
+        if self.frame_size is not None and frame.get_size() != tuple(self.frame_size):
+            frame = pg.transform.smoothscale(frame, self.frame_size)
+        return pg.surfarray.array3d(frame).swapaxes(0, 1)
+
+    def close(self):
+        pass
+
+
+class VectorEnv(object):
+    # n GameEnvs in one process, stepped in lockstep. Observations and rewards are stacked along a new first axis.
+    # An env whose episode ends is reset straight away, and the observation it ended on goes in its info under
+    # 'final_observation'.
+    def __init__(self, n, seed=None, **kwargs):
+        seeds = random.Random(seed)
+        self.envs = [GameEnv(seeds.getrandbits(32), **kwargs) for _ in range(n)]
+
+    def __len__(self):
+        return len(self.envs)
+
+    @staticmethod
+    def _stack(observations):
+        return {key: np.stack([observation[key] for observation in observations]) for key in observations[0]}
+
+    def reset(self, seed=None):
+        if seed is not None:
+            seeds = random.Random(seed)
+            results = [env.reset(seeds.getrandbits(32)) for env in self.envs]
+        else:
+            results = [env.reset() for env in self.envs]
+        return self._stack([observation for observation, _ in results]), [info for _, info in results]
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.float64).reshape(len(self.envs), ACTION_SIZE)
+        observations = []
+        rewards = np.zeros(len(self.envs), dtype=np.float32)
+        terminated = np.zeros(len(self.envs), dtype=bool)
+        truncated = np.zeros(len(self.envs), dtype=bool)
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            observation, rewards[i], terminated[i], truncated[i], info = env.step(action)
+            if terminated[i] or truncated[i]:
+                info['final_observation'] = observation
+                observation, reset_info = env.reset()
+                info['seed'] = reset_info['seed']
+            observations.append(observation)
+            infos.append(info)
+        return self._stack(observations), rewards, terminated, truncated, infos
+
+    def render(self):
+        return np.stack([env.render() for env in self.envs])
+
+    def close(self):
+        for env in self.envs:
+            env.close()
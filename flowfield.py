@@ -0,0 +1,133 @@
+import heapq
+import math
+
+import numpy as np
+
+# Orthogonal steps cost 2 and diagonal ones 3, a close enough integer stand-in for 1 and sqrt(2)
+STEPS = (
+    (1, 0, 2), (-1, 0, 2), (0, 1, 2), (0, -1, 2),
+    (1, 1, 3), (1, -1, 3), (-1, 1, 3), (-1, -1, 3),
+)
+
+
+class FlowField(object):
+    # Shortest paths from every open tile to the player's tile, shared by all enemies. The field is rebuilt with one
+    # Dijkstra pass when the player changes tiles, after which steering any number of enemies is a lookup each.
+    def __init__(self, grid, max_length=None):
+        self.grid = grid
+        # Paths longer than this many pixels aren't worth knowing about, so on big levels the search stops there
+        self.max_length = max_length
+        self.target = None
+        size = grid.cols * grid.rows
+        self.distance = [None] * size
+        self.next_tile = [None] * size
+        self.rebuilds = 0
+        self._blocked = None
+
+    def _layout(self):
+        # The open tiles as a flat list with a blocked border all round, so the search never has to bounds check.
+        # Column-major, so that ties in the heap still go by column and then row. Rebuilt when the walls change.
+        grid = self.grid
+        blocked = grid.blocked_tiles()
+        if blocked is self._blocked:
+            return
+        self._blocked = blocked
+        cols = grid.cols
+        rows = grid.rows
+        height = rows + 2
+        padded = np.ones((cols + 2, height), dtype=bool)
+        padded[1:-1, 1:-1] = blocked.T
+        self._open = (~padded).ravel().tolist()
+        # Padded index to the (col, row) and flat row-major index everything outside the search uses
+        self._tiles = [(p // height - 1, p % height - 1) for p in range(len(self._open))]
+        self._indices = [row * cols + col for col, row in self._tiles]
+        # Offset to the neighbour, cost, and the two tiles a diagonal step squeezes between (0 for straight steps)
+        self._steps = [
+            (dc * height + dr, cost, dc * height if dc and dr else 0, dr if dc and dr else 0)
+            for dc, dr, cost in STEPS
+        ]
+
+    def _build(self, target):
+        grid = self.grid
+        cols = grid.cols
+        rows = grid.rows
+        distance = [None] * (cols * rows)
+        next_tile = [None] * (cols * rows)
+        self.target = target
+        self.distance = distance
+        self.next_tile = next_tile
+        self.rebuilds += 1
+
+        col, row = target
+        if not grid.in_bounds(col, row) or grid.is_blocked(col, row):
+            return
+
+        self._layout()
+        is_open = self._open
+        tiles = self._tiles
+        indices = self._indices
+        steps = self._steps
+        limit = math.inf if self.max_length is None else self.max_length / grid.tile_size * 2
+        start = (col + 1) * (rows + 2) + row + 1
+        best = [math.inf] * len(is_open)
+        best[start] = 0
+        distance[row * cols + col] = 0
+        queue = [(0, start)]
+        while queue:
+            dist, p = heapq.heappop(queue)
+            if dist > best[p]:
+                continue
+            for step, cost, side_a, side_b in steps:
+                n = p + step
+                if not is_open[n]:
+                    continue
+                # No cutting corners, an enemy can't squeeze diagonally between two walls
+                if side_a and (not is_open[p + side_a] or not is_open[p + side_b]):
+                    continue
+                new_dist = dist + cost
+                if new_dist > limit or new_dist >= best[n]:
+                    continue
+                best[n] = new_dist
+                index = indices[n]
+                distance[index] = new_dist
+                # Paths are built outwards from the target, so the way back is the tile we came from
+                next_tile[index] = tiles[p]
+                heapq.heappush(queue, (new_dist, n))
+
+    def update(self, target_pos):
+        target = self.grid.tile_at(*target_pos)
+        if target != self.target:
+            self._build(target)
+
+    def path_length(self, pos, target_pos):
+        # Roughly how far in pixels an enemy at pos would have to walk to reach target_pos, or None if it can't
+        self.update(target_pos)
+        col, row = self.grid.tile_at(*pos)
+        if not self.grid.in_bounds(col, row):
+            return None
+        dist = self.distance[row * self.grid.cols + col]
+        if dist is None:
+            return None
+        return dist / 2 * self.grid.tile_size
+
+    def steer(self, pos, target_pos):
+        # Unit vector for an enemy at pos to move along, (0, 0) if there's no way through
+        self.update(target_pos)
+        grid = self.grid
+        col, row = grid.tile_at(*pos)
+        if (col, row) == self.target or not grid.in_bounds(col, row):
+            goal = target_pos
+        else:
+            step = self.next_tile[row * grid.cols + col]
+            if step is None:
+                return (0, 0)
+            # Head for the middle of the next tile so the enemy's rect clears the corners it passes
+            half = grid.tile_size / 2
+            goal = (step[0] * grid.tile_size + half, step[1] * grid.tile_size + half)
+
+        dx = goal[0] - pos[0]
+        dy = goal[1] - pos[1]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return (0, 0)
+        return (dx / length, dy / length)
@@ -1,13 +1,28 @@
-import csv
 import os
+import random
 import sys
+import time
 from enum import Enum
 
 import pygame as pg
 import pygame_gui as pgui
 
-from entities import Player, Enemy, Wall, Bullet, Collectable, PLAYERDEADEVENT
-from levels import LevelManager
+from bullets import BulletManager, TARGET_ENEMY, TARGET_PLAYER
+from camera import Camera
+from entities import Player, Enemy, Collectable, PLAYERDEADEVENT
+from flowfield import FlowField
+from hud import Hud, HudText
+from levels import COLLECTABLE, ENEMY, PLAYER, WALL, Level, LevelManager, PreparedLevel, run_steps
+from profiling import Profiler, ProfilerOverlay
+from regions import RegionMap
+from render import ChunkedTilemap, ViewLayer
+from resources import image_cache
+from scheduler import Scheduler
+from simulation import DeviceInput, FixedTimestep, RealClock, SimulatedClock
+from snapshot import restore, snapshot
+from spatial import TileGrid, merge_tiles
+from swarm import EnemySwarm
+from visibility import Visibility
 
 
 class GameState(Enum):
@@ -21,101 +36,77 @@ class GameState(Enum):
     WIN = 8
 
 
-class LevelText(pg.sprite.Sprite):
+class LevelText(HudText):
     def __init__(self, game, x, y, name):
-        super().__init__()
-
-        self.game = game
-
-        self.font = pg.font.Font(None, 40)
-        self.f_color = pg.Color('#FFFFFF')
         self.name = name
-        self.image = self.font.render(f'Level: {self.name}', True, self.f_color)
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-
-        self.game.entities.add(self)
-
-    def draw(self):
-        self.game.window.blit(self.image, self.rect)
-
-    def update(self):
-        self.image = self.font.render(f'Level: {self.name}', True, self.f_color)
-
-
-class StatsHeaderText(pg.sprite.Sprite):
-    def __init__(self, game, x, y):
-        super().__init__()
-
-        self.game = game
-
-        self.font = pg.font.Font(None, 40)
-        self.f_color = pg.Color('#FFFFFF')
-        self.image = self.font.render('Stats:', True, self.f_color)
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-
-        self.game.entities.add(self)
+        super().__init__(game, x, y)
 
-    def draw(self):
-        self.game.window.blit(self.image, self.rect)
+    def text(self, value):
+        return f'Level: {self.name}'
 
-    def update(self):
-        self.image = self.font.render('Stats:', True, self.f_color)
 
+class StatsHeaderText(HudText):
+    def text(self, value):
+        return 'Stats:'
 
-class StatsHealthText(pg.sprite.Sprite):
-    def __init__(self, game, x, y):
-        super().__init__()
 
-        self.game = game
+class StatsHealthText(HudText):
+    color = '#058c0d'
 
-        self.font = pg.font.Font(None, 40)
-        self.f_color = pg.Color('#058c0d')
-        self.image = self.font.render(f'Health: {self.game.player.health}/{self.game.player.max_health}', True, self.f_color)
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+    def value(self):
+        return (self.game.player.health, self.game.player.max_health)
 
-        self.game.entities.add(self)
+    def text(self, value):
+        return f'Health: {value[0]}/{value[1]}'
 
-    def draw(self):
-        self.game.window.blit(self.image, self.rect)
 
-    def update(self): 
-        self.image = self.font.render(f'Health: {self.game.player.health}/{self.game.player.max_health}', True, self.f_color)
+class StatsDamageText(HudText):
+    color = '#7d0909'
 
+    def value(self):
+        return self.game.player.damage
 
-class StatsDamageText(pg.sprite.Sprite):
-    def __init__(self, game, x, y):
-        super().__init__()
-
-        self.game = game
-
-        self.font = pg.font.Font(None, 40)
-        self.f_color = pg.Color('#7d0909')
-        self.image = self.font.render(f'Damage: {self.game.player.damage}', True, self.f_color)
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-
-        self.game.entities.add(self)
-
-    def draw(self):
-        self.game.window.blit(self.image, self.rect)
-
-    def update(self):
-        self.image = self.font.render(f'Damage: {self.game.player.damage}', True, self.f_color)
+    def text(self, value):
+        return f'Damage: {value}'
 
 
 # TODO: finish implementing the game window specific stuff and get some game UI done
 class Game(object):
-    def __init__(self, wind_width, wind_height, game_width, game_height, tile_size):
+    def __init__(self, wind_width, wind_height, game_width, game_height, tile_size, headless=False, frame_clock=None,
+                 input_source=None, seed=None):
+        # A headless game never opens a window. It renders (if at all) into an off-screen surface, and is normally
+        # paired with ScriptedInput so it can run without a display or real time.
+        self.headless = headless
+        if self.headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
         pg.init()
         self.state = GameState.TITLE
         self.fps = 30
+        # Gameplay runs in fixed ticks, independent of how often frames are drawn. Speeds and timers are per tick.
+        self.tick_rate = 30
+        # Reuse line of sight results per (enemy tile, player tile) until the player moves to another tile. The first
+        # ray cast from a tile stands in for every position in it, so this is approximate and off for normal play.
+        self.cache_line_of_sight = False
+        # Number of angles the player sprite is pre-rotated to, and how many bytes of rotated frames to keep around
+        self.rotation_buckets = 360
+        self.rotation_budget = 16 * 1024 * 1024
+        # Levels bigger than the play area scroll. Their background is pre-rendered in square chunks of this many
+        # tiles, keeping at most this many bytes of chunks around.
+        self.chunk_tiles = 16
+        self.tilemap_budget = 32 * 1024 * 1024
+        # The next level is prepared in the time left at the end of frames, but only until this much of the frame's
+        # time has gone
+        self.prepare_share = 0.75
+        # Enemies only ever chase the player along paths shorter than their sight range, so there's no need to search
+        # much further than that
+        self.flow_field_range = 1000
+        # Enemies more than this many pixels outside the view are asleep. Which ones is worked out per region of
+        # this many tiles square, so it only has to be redone when the view crosses into another region.
+        self.wake_margin = 512
+        self.region_tiles = 8
+        # Run enemy AI as one vectorized pass over every enemy instead of per sprite, for levels with huge crowds
+        self.batched_ai = False
         # Overall window size
         self.wind_width = wind_width
         self.wind_height = wind_height
@@ -131,8 +122,6 @@ class Game(object):
 
         self.level_manager = LevelManager()
 
-        self._init_groups()
-
         # Size of the gameplay area
         self.game_width = game_width
         self.game_height = game_height
@@ -140,20 +129,73 @@ class Game(object):
         self.tile_size = tile_size
         self.window = pg.display.set_mode((self.wind_width, self.wind_height))
         pg.display.set_caption('Crypto Crime Fighter')
+        # The play area of the window. Drawing the world into it keeps sprites out of the sidebar.
+        self.view_surface = self.window.subsurface(self.game_rect)
+
+        # Until a level says otherwise the world is exactly the play area
+        self.world_rect = self.game_rect.copy()
+        self.camera = Camera(self.game_rect.size, self.world_rect.size)
+        self.entity_layer = ViewLayer(self.camera)
+
+        # Everything in the game reads time and input through these rather than pygame directly. Gameplay time is
+        # simulated and advances by exactly one tick per update, while frame_clock paces drawing in real time.
+        self.clock = SimulatedClock()
+        self.frame_clock = frame_clock if frame_clock is not None else (SimulatedClock() if self.headless else RealClock())
+        self.timestep = FixedTimestep(self.tick_rate)
+        self.input = input_source if input_source is not None else DeviceInput()
+        if getattr(self.input, 'game', False) is None:
+            self.input.game = self
+        self.tick_count = 0
+        # Entity timers (enemy decisions, hit states) in gameplay time. It belongs to the game rather than the level
+        # because the player and its timers carry over between levels.
+        self.scheduler = Scheduler()
+        # Saved with F5 and loaded with F9
+        self.quicksave = None
+        # Input recordings only hold input, so a session that jumps back to a quicksave can't be replayed from one.
+        # Recording and replaying turn loading off.
+        self.quickload = True
+
+        # Timing scopes around each part of a frame, shown in the sidebar with F3
+        self.profiler = Profiler()
+        self.profiler_overlay = ProfilerOverlay(
+            self.profiler,
+            (self.game_width + 10, 260, self.wind_width - self.game_width - 20, 420),
+            1000 / self.fps
+        )
+
+        # All gameplay randomness comes from here so that a seed and the input reproduce a run exactly
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+
+        # Groups have to come after the display is set up because the bullet pool loads its image
+        self._init_groups()
 
     def _init_groups(self):
-        # Set up game clock and groups
-        self.game_clock = pg.time.Clock()
+        # Set up game groups
         self.entities = pg.sprite.RenderUpdates()
-        self.bullets = pg.sprite.Group()
+        # The sprites that get updated every tick after the player. That's every enemy that isn't asleep.
+        self.active = pg.sprite.Group()
+        self.bullets = BulletManager(self)
         self.enemies = pg.sprite.Group()
-        self.walls = pg.sprite.Group()
         self.collectables = pg.sprite.Group()
+        self.swarm = EnemySwarm(self) if self.batched_ai else None
+
+    def new_game(self, levels=None):
+        # Load every image up front so that no file I/O happens once the level is running
+        image_cache.preload(f for f in os.listdir(image_cache.base_path) if f.endswith('.png'))
+
+        # Every new game replays the same tick sequence for the same seed and input
+        self.clock = SimulatedClock()
+        self.rng = random.Random(self.seed)
+        self.tick_count = 0
+        self.scheduler = Scheduler()
+        # The tick each level was cleared on
+        self.level_ticks = []
+        self.input.start(self.seed)
 
-    def new_game(self):
         # Initialize the player
         self.player = Player(self)
-        self.level_manager = LevelManager()
+        self.level_manager = LevelManager(levels)
 
         self.play_level()
 
@@ -164,6 +206,7 @@ class Game(object):
         level = self.level_manager.get_level()
 
         # Set up stats text
+        self.hud = Hud()
         x_offset = self.game_width + 10
         y_offset = 10
 
@@ -179,35 +222,130 @@ class Game(object):
         self.stat_text_dmg = StatsDamageText(self, x_offset, y_offset)
         
 
-        level_grid = level.load()
-
-        # Set up the background tiles
-        background_tile = self.load_image('BlueTileFloor.png')
-        self.background = pg.Surface(self.screen_rect.size)
-        for x in range(0, self.game_width, self.tile_size):
-            for y in range(0, self.game_height, self.tile_size):
-                grid_x = int(x / self.tile_size)
-                grid_y = int(y / self.tile_size)
-
-                if level_grid[grid_y][grid_x] == 'W':
-                    Wall(self, x, y)
-                elif level_grid[grid_y][grid_x] == 'E':
-                    Enemy(self, x, y)
-                elif level_grid[grid_y][grid_x] == 'P':
-                    # todo: change the player around so that we can initialize it with a position
-                    self.player.rect.x = x
-                    self.player.rect.y = y
-                elif level_grid[grid_y][grid_x] == 'C':
-                    Collectable(self, x, y)
-                
-                self.background.blit(background_tile, (x, y))
+        prepared = self.level_manager.prepared(self.prepare_level_steps)
+        self.world_rect = pg.Rect((0, 0), prepared.size)
+        self.wall_grid = prepared.wall_grid
+        self.visibility = Visibility(self.wall_grid, cache=self.cache_line_of_sight)
+        self.flow_field = FlowField(self.wall_grid, max_length=self.flow_field_range)
+
+        # Walls are only ever drawn through the tilemap and collided with through the wall grid, so all that's kept of
+        # them here is how many there are
+        self.wall_count = len(prepared.walls)
+
+        for code, x, y in prepared.spawns:
+            if code == ENEMY:
+                Enemy(self, x, y)
+            elif code == PLAYER:
+                # todo: change the player around so that we can initialize it with a position
+                self.player.rect.x = x
+                self.player.rect.y = y
+            elif code == COLLECTABLE:
+                Collectable(self, x, y)
+
+        # The background is whatever part of the tilemap the camera is looking at, with the walls already drawn in
+        self.tilemap = prepared.tilemap
+        self.camera = Camera(self.game_rect.size, self.world_rect.size)
+        self.camera.follow(self.player.rect)
+        self.entity_layer = ViewLayer(self.camera)
+        self.background = pg.Surface(self.screen_rect.size).convert()
+        self.background_view = None
+        self.refresh_background()
+
+        # Put everything far from the player to sleep before the first tick
+        self.regions = RegionMap(self, self.region_tiles * self.tile_size, self.wake_margin)
+        self.regions.update()
+
+        self.bullets.set_walls(self.wall_grid)
+
+        # Get the next level ready while this one is played, so the transition doesn't stall
+        self.level_manager.prefetch_next()
 
         self.window.blit(self.background, (0, 0))
         self.window.blit(self.sidebar_surface, (self.game_width, 0))
-        pg.display.flip()
+        if not self.headless:
+            pg.display.flip()
 
         self.state = GameState.PLAYING
 
+    def prepare_level(self, level):
+        return run_steps(self.prepare_level_steps(level))
+
+    def prepare_level_steps(self, level):
+        # Builds the parts of a level that don't depend on game state, as a generator that yields between pieces of
+        # work and returns the PreparedLevel, so the next level can be got ready a piece per frame. The compiled level
+        # may already have been read on the prefetch thread, but the tilemap and its surfaces are always made here on
+        # the main thread.
+        compiled = level.compiled()
+        ts = self.tile_size
+        # Levels can be bigger than the play area, but never smaller
+        size = (max(compiled.cols * ts, self.game_width), max(compiled.rows * ts, self.game_height))
+        wall_image = self.load_image('BlueWall.png')
+        walls = []
+        wall_tiles = []
+        spawns = []
+        # The spawn table only lists the non-empty tiles, so there's no need to walk the whole grid
+        for code, grid_x, grid_y in compiled.spawns:
+            x = grid_x * ts
+            y = grid_y * ts
+            if code == WALL:
+                walls.append((x, y))
+                wall_tiles.append((grid_x, grid_y))
+            else:
+                spawns.append((code, x, y))
+        yield
+
+        tilemap = ChunkedTilemap(
+            size, ts, self.load_image('BlueTileFloor.png'), [(wall_image, col, row) for col, row in wall_tiles],
+            self.chunk_tiles, self.tilemap_budget
+        )
+        # Render the part of the level it opens on now, rather than during its first frame
+        camera = Camera(self.game_rect.size, size)
+        for code, x, y in spawns:
+            if code == PLAYER:
+                camera.follow(pg.Rect(x, y, ts, ts))
+        yield
+        for col, row in tilemap.chunks_in(camera.view):
+            tilemap.chunk(col, row)
+            yield
+
+        # Walls come in long runs, so rather than one collider per tile the runs are merged into a few big rects.
+        # That only gives the same shape when the wall image fills its whole tile.
+        wall_rect = wall_image.get_bounding_rect()
+        if wall_rect == pg.Rect(0, 0, ts, ts):
+            colliders = [pg.Rect(col * ts, row * ts, w * ts, h * ts) for col, row, w, h in merge_tiles(wall_tiles)]
+        else:
+            colliders = [wall_rect.move(x, y) for x, y in walls]
+        yield
+        wall_grid = TileGrid(size[0], size[1], ts)
+        for rect in colliders:
+            wall_grid.add(rect)
+        # Built now rather than on the level's first tick
+        wall_grid.blocked_tiles()
+        return PreparedLevel(level, compiled, size, tilemap, walls, spawns, wall_grid)
+
+    def refresh_background(self):
+        # Redraws the background for wherever the camera is now. Returns True if it had to, i.e. the view scrolled.
+        view = self.camera.view
+        if view == self.background_view:
+            return False
+        self.tilemap.draw(self.background.subsurface(self.game_rect), view)
+        self.background_view = view.copy()
+        return True
+
+    def clear_world(self):
+        self.entity_layer.clear(self.window, self.background)
+        self.bullets.clear(self.window, self.background)
+
+    def draw_world(self):
+        # Draws everything in view and returns the rects that changed. If the camera moved the whole play area did.
+        changes = []
+        if self.refresh_background():
+            self.window.blit(self.background, self.game_rect, self.game_rect)
+            changes.append(self.game_rect.copy())
+        changes += self.entity_layer.draw(self.view_surface, self.entities)
+        changes += self.bullets.draw(self.view_surface, self.camera.view)
+        return changes
+
     def title_menu(self):
         manager = pgui.UIManager(self.screen_rect.size)
         bg = pg.Surface(self.screen_rect.size)
@@ -628,10 +766,20 @@ Andy
     def game_loop(self):
         self.window.blit(self.background, (0, 0))
         self.window.blit(self.sidebar_surface, (self.game_width, 0))
-        
+        self.hud.draw(self.window, self.background, force=True)
+
         pg.display.flip()
+
+        # Time spent in menus doesn't count towards the simulation
+        self.frame_clock.reset()
+        self.timestep.reset()
+        profiler = self.profiler
         while True:
-            self.game_clock.tick(self.fps)
+            elapsed = self.frame_clock.tick(self.fps)
+            frame_start = time.perf_counter()
+            profiler.begin_frame()
+            # Loading a save changes everything on screen, the same as a new level does
+            level_changed = False
             for event in pg.event.get():
                 if event.type == pg.QUIT:
                     self.state = GameState.EXIT
@@ -640,65 +788,197 @@ Andy
                     if event.key == pg.K_ESCAPE:
                         self.state = GameState.PAUSE
                         return
+                    if event.key == pg.K_F3:
+                        profiler.toggle()
+                    if event.key == pg.K_F5:
+                        self.quicksave = self.save_state()
+                    if event.key == pg.K_F9 and self.quickload and self.quicksave is not None:
+                        self.load_state(self.quicksave)
+                        level_changed = True
                 if event.type == PLAYERDEADEVENT:
                     self.state = GameState.GAMEOVER
                     return
 
-            if len(self.enemies) == 0:
-                if self.level_manager.is_final_level():
-                    self.state = GameState.WIN
-                    return
-                self.level_manager.next_level()
-                self.play_level()
-
-            self.entities.clear(self.window, self.background)
-            self.entities.update()
+            with profiler.scope('clear'):
+                self.clear_world()
 
+            # Run however many ticks fit in the time since the last frame, then draw the result once
+            ticks = self.timestep.advance(elapsed)
+            for _ in range(ticks):
+                if len(self.enemies) == 0:
+                    if not self.advance_level():
+                        return
+                    level_changed = True
+
+                self.update_world()
+
+                # Don't keep simulating past the player's death, the event is handled on the next frame
+                if self.player.health <= 0:
+                    break
+
+            with profiler.scope('draw'):
+                changes = self.draw_world()
+
+                # The sidebar is only redrawn when one of the stats it shows has changed
+                self.hud.update()
+                changes += self.hud.draw(self.window, self.background, force=level_changed)
+                changes += self.profiler_overlay.draw(self.window, self.background)
+
+            with profiler.scope('display'):
+                if level_changed:
+                    pg.display.flip()
+                else:
+                    pg.display.update(changes)
+
+            # Whatever time the frame has left goes on getting the next level ready
+            with profiler.scope('prepare'):
+                self.level_manager.prepare_ahead(self.prepare_level_steps, frame_start + self.prepare_share / self.fps)
+
+            profiler.end_frame(
+                ticks=ticks,
+                sprites=len(self.entities),
+                enemies=len(self.enemies),
+                asleep=len(self.regions),
+                bullets=len(self.bullets),
+                timers=len(self.scheduler),
+                dirty_rects=len(changes),
+                candidate_pairs=self.bullets.candidate_pairs,
+                hit_pairs=self.bullets.hit_pairs
+            )
+            self.bullets.candidate_pairs = 0
+            self.bullets.hit_pairs = 0
+
+    def advance_level(self):
+        # Called once every enemy is dead. Returns False when that was the last level and the game is won.
+        self.level_ticks.append(self.tick_count)
+        if self.level_manager.is_final_level():
+            self.state = GameState.WIN
+            return False
+        self.level_manager.next_level()
+        self.play_level()
+        return True
+
+    def update_world(self):
+        # One tick of gameplay, with no drawing. Shared by the real game loop and headless simulation.
+        self.input.poll()
+        profiler = self.profiler
+
+        # Bullets move before the sprites update so that anything fired this tick starts moving on the next one
+        with profiler.scope('bullets'):
+            self.bullets.update()
+        # Wake up whatever the player is getting close to, and put to sleep what they left behind
+        with profiler.scope('regions'):
+            self.regions.update()
+
+        # The player moves first, so that enemies making decisions this tick see where the player is now
+        with profiler.scope('player'):
+            self.player.update()
+        # Only the entities whose timers are due make decisions this tick, everything else just keeps moving
+        with profiler.scope('timers'):
+            self.scheduler.run(self.clock.get_ticks())
+        if self.swarm is not None:
+            with profiler.scope('swarm'):
+                self.swarm.update()
+        with profiler.scope('update'):
+            profiler.update_group(self.active)
+
+        with profiler.scope('collisions'):
             self.check_collisions()
 
-            changes = self.entities.draw(self.window)
-            pg.display.update(changes)
+        # The view follows the player tick by tick rather than frame by frame, because aiming depends on it
+        self.camera.follow(self.player.rect)
+
+        self.clock.advance(self.timestep.tick_ms)
+        self.tick_count += 1
+
+    def simulate(self, ticks):
+        # Runs up to the given number of ticks headlessly, as fast as possible. Stops early if the player dies or
+        # the last level is cleared, and returns the game state it finished in.
+        for _ in range(ticks):
+            if not self.step_tick():
+                break
+        return self.state
+
+    def step_tick(self):
+        # One tick of headless play, with the checks the game loop makes between ticks on either side of it. Returns
+        # False once play is over, and the game's state says whether it was won or lost.
+        if self.state != GameState.PLAYING or not self._between_ticks():
+            return False
+        self.update_world()
+        # Nothing reads the event queue when headless, so don't let it fill up
+        pg.event.clear()
+        return self._between_ticks()
+
+    def _between_ticks(self):
+        # The player dying ends the game, and clearing a level moves on to the next one
+        if self.player.health <= 0:
+            self.state = GameState.GAMEOVER
+            return False
+        if len(self.enemies) == 0:
+            return self.advance_level()
+        return True
+
+    def save_state(self):
+        # Everything about the game in play as a compact byte string, cheap enough to take every tick
+        return snapshot(self)
+
+    def load_state(self, data):
+        # Goes back to a state from save_state, starting a game first if there isn't one
+        if getattr(self, 'player', None) is None:
+            self.new_game()
+        restore(self, data)
+        self.state = GameState.PLAYING
 
     def load_image(self, filename):
-        fullpath = os.path.join('.', 'assets', 'images', filename)
-        try:
-            surface = pg.image.load(fullpath)
-        except pg.error:
-            raise RuntimeError(f'Unable to load image "{fullpath}". error: {pg.get_error()}')
-        return surface.convert_alpha()
+        # Images are loaded and converted once per process, every caller after that gets the shared surface
+        return image_cache.get(filename)
 
     def load_level(self, filename):
-        level = []
-        fullpath = os.path.join('.', 'assets', 'levels', filename)
-
-        with open(fullpath, 'r') as fh:
-            reader = csv.reader(fh, delimiter=',')
-            for row in reader:
-                level.append(row)
-        return level
+        return Level(filename, filename).load()
 
     def check_collisions(self):
-        # Check for bullet collisions
-        for bullet in self.bullets:
-            if bullet.target == Enemy:
-                for enemy in pg.sprite.spritecollide(bullet, self.enemies, False):
-                    enemy.take_hit(bullet.damage)
-                    bullet.remove()
-
-            for _ in pg.sprite.spritecollide(bullet, self.walls, False):
-                bullet.remove()
+        bullets = self.bullets
+
+        # Bullets are tested along the whole path of their last move rather than just where they ended up, so fast
+        # ones can't skip over walls or enemies. Whatever a bullet reaches before the first wall on its path counts.
+        wall_entry = bullets.wall_entry()
+
+        # Check for bullet collisions. Only the first bullet to reach an enemy each frame can hurt it, because it's
+        # then either dead or in its hit state. Everything else touching a live enemy is absorbed.
+        player_bullets = bullets.active(TARGET_ENEMY)
+        hits = []
+        if len(player_bullets):
+            enemies = self.enemies.sprites()
+            reached = bullets.reaching([enemy.rect for enemy in enemies], player_bullets, wall_entry)
+            for order, (enemy, touching) in enumerate(zip(enemies, reached)):
+                if len(touching):
+                    hits.append((bullets.serial[touching[0]], order, enemy, touching))
+
+        for _, _, enemy, touching in sorted(hits, key=lambda hit: hit[:2]):
+            enemy.take_hit(int(bullets.damage[touching[0]]))
+            if enemy.alive():
+                bullets.kill(touching)
+            else:
+                # Bullets behind the killing shot pass through where the enemy used to be
+                bullets.kill(touching[:1])
+
+        bullets.hit_walls(wall_entry)
 
         # Check for player on enemy collisions
         for enemy in pg.sprite.spritecollide(self.player, self.enemies, False):
             self.player.take_hit(enemy.melee_dmg)
 
         # Check for player on enemy bullet collisions
-        for bullet in pg.sprite.spritecollide(self.player, self.bullets, False):
-            if bullet.target == Player:
-                self.player.take_hit(bullet.damage)
-                bullet.remove()
+        enemy_bullets = bullets.active(TARGET_PLAYER)
+        for slot in bullets.reaching([self.player.rect], enemy_bullets, wall_entry)[0]:
+            self.player.take_hit(int(bullets.damage[slot]))
+            bullets.kill([slot])
+
+        bullets.cull()
 
-        # Check for player on collectable collisions
+        # Check for player on collectable collisions. Loot dropped by enemies killed above can be picked up on the
+        # same frame.
         for item in pg.sprite.spritecollide(self.player, self.collectables, True):
             self.player.heal(item.reward_health)
             self.player.damage += item.reward_damage
+            self.player.collectables_picked += 1
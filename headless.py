@@ -0,0 +1,19 @@
+from game import Game
+
+WIND_WIDTH = 1680
+WIND_HEIGHT = 1088
+GAME_WIDTH = 1280
+GAME_HEIGHT = WIND_HEIGHT
+TILE_SIZE = 32
+
+
+def make_game(input_source=None, seed=1, cache_line_of_sight=False):
+    # A game for tools that drive it from code (benchmarks, the batch runner, the training env), which never need a
+    # real window. cache_line_of_sight trades exact line of sight for speed, off by default so headless runs play the
+    # same as the real game.
+    game = Game(
+        WIND_WIDTH, WIND_HEIGHT, GAME_WIDTH, GAME_HEIGHT, TILE_SIZE,
+        headless=True, input_source=input_source, seed=seed
+    )
+    game.cache_line_of_sight = cache_line_of_sight
+    return game
@@ -0,0 +1,93 @@
+import pygame as pg
+
+
+class TextRenderer(object):
+    # Fonts are shared by size and rendered text is kept by (string, color, size), so the same label is only
+    # ever rendered once no matter how many HUD elements or frames ask for it.
+    def __init__(self):
+        self.fonts = {}
+        self.rendered = {}
+        self.renders = 0
+
+    def font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = pg.font.Font(None, size)
+            self.fonts[size] = font
+        return font
+
+    def render(self, text, color, size=40):
+        key = (text, tuple(pg.Color(color)), size)
+        surface = self.rendered.get(key)
+        if surface is None:
+            self.renders += 1
+            surface = self.font(size).render(text, True, color)
+            self.rendered[key] = surface
+        return surface
+
+    def clear(self):
+        self.rendered.clear()
+
+
+text_renderer = TextRenderer()
+
+
+class HudText(object):
+    # A line of sidebar text bound to a value. The text is only re-rendered, and the sidebar only marked dirty,
+    # when value() returns something different from last time.
+    color = '#FFFFFF'
+    size = 40
+
+    def __init__(self, game, x, y):
+        self.game = game
+        self.f_color = pg.Color(self.color)
+        self.bound = self.value()
+        self.image = text_renderer.render(self.text(self.bound), self.f_color, self.size)
+        self.rect = self.image.get_rect()
+        self.rect.x = x
+        self.rect.y = y
+        self.last_rect = self.rect.copy()
+        self.dirty = True
+
+        self.game.hud.add(self)
+
+    def value(self):
+        return None
+
+    def text(self, value):
+        return ''
+
+    def update(self):
+        bound = self.value()
+        if bound == self.bound:
+            return
+        self.bound = bound
+        self.image = text_renderer.render(self.text(bound), self.f_color, self.size)
+        self.rect.size = self.image.get_size()
+        self.dirty = True
+
+
+class Hud(object):
+    def __init__(self):
+        self.texts = []
+
+    def add(self, text):
+        self.texts.append(text)
+
+    def update(self):
+        for text in self.texts:
+            text.update()
+
+    def draw(self, surface, background, force=False):
+        # Returns the rects that changed on screen. force redraws everything, for when the whole window was repainted.
+        changes = []
+        for text in self.texts:
+            if not (text.dirty or force):
+                continue
+            # Clear where the text used to be in case the new text is shorter
+            surface.blit(background, text.last_rect, text.last_rect)
+            surface.blit(text.image, text.rect)
+            changes.append(text.last_rect.union(text.rect))
+            text.last_rect = text.rect.copy()
+            text.dirty = False
+        return changes
@@ -1,29 +1,198 @@
 import csv
+import mmap
 import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LEVEL_DIR = os.path.join('.', 'assets', 'levels')
+# Compiled levels live next to the sources and are rebuilt whenever the source file changes
+CACHE_DIR = os.path.join(LEVEL_DIR, '.cache')
+
+# Tile codes in the compiled format
+EMPTY = 0
+WALL = 1
+ENEMY = 2
+PLAYER = 3
+COLLECTABLE = 4
+TILE_CODES = {'W': WALL, 'E': ENEMY, 'P': PLAYER, 'C': COLLECTABLE}
+
+# magic, format version, source mtime (ns), source size, columns, rows, spawn count
+HEADER = struct.Struct('<4sBqqHHI')
+# tile code, column, row
+SPAWN = struct.Struct('<BHH')
+MAGIC = b'CCFL'
+VERSION = 1
+
+
+class CompiledLevel(object):
+    # A level as a packed grid of uint8 tile codes plus a spawn table of every non-empty tile. The spawn table is
+    # in column-major order, the same order play_level has always created sprites in.
+    def __init__(self, cols, rows, tiles, spawns):
+        self.cols = cols
+        self.rows = rows
+        self.tiles = tiles
+        self.spawns = spawns
+
+    def tile(self, col, row):
+        return self.tiles[row * self.cols + col]
+
+    @classmethod
+    def from_grid(cls, grid):
+        rows = len(grid)
+        cols = max((len(row) for row in grid), default=0)
+        tiles = bytearray(cols * rows)
+        for row, cells in enumerate(grid):
+            for col, cell in enumerate(cells):
+                tiles[row * cols + col] = TILE_CODES.get(cell, EMPTY)
+
+        spawns = []
+        for col in range(cols):
+            for row in range(rows):
+                code = tiles[row * cols + col]
+                if code != EMPTY:
+                    spawns.append((code, col, row))
+        return cls(cols, rows, bytes(tiles), spawns)
+
+    def pack(self, mtime, size):
+        parts = [HEADER.pack(MAGIC, VERSION, mtime, size, self.cols, self.rows, len(self.spawns)), self.tiles]
+        parts.extend(SPAWN.pack(*spawn) for spawn in self.spawns)
+        return b''.join(parts)
+
+    @classmethod
+    def unpack(cls, buf, mtime=None, size=None):
+        # Returns None if buf isn't a compiled level, or was compiled from a different version of the source
+        if len(buf) < HEADER.size:
+            return None
+        magic, version, src_mtime, src_size, cols, rows, spawn_count = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            return None
+        if mtime is not None and (src_mtime != mtime or src_size != size):
+            return None
+
+        offset = HEADER.size
+        tiles = bytes(buf[offset:offset + cols * rows])
+        offset += cols * rows
+        if len(buf) < offset + spawn_count * SPAWN.size:
+            return None
+        spawns = list(SPAWN.iter_unpack(buf[offset:offset + spawn_count * SPAWN.size]))
+        return cls(cols, rows, tiles, spawns)
+
+
+class PreparedLevel(object):
+    # Everything about a level that can be worked out before play starts: the compiled data, its size in pixels, the
+    # tilemap the background is drawn from, the pixel positions of every spawn and the TileGrid of merged wall
+    # colliders. Sprites are still created by play_level.
+    def __init__(self, level, compiled, size, tilemap, walls, spawns, wall_grid):
+        self.level = level
+        self.compiled = compiled
+        self.size = size
+        self.tilemap = tilemap
+        self.walls = walls
+        self.spawns = spawns
+        self.wall_grid = wall_grid
+
 
 class Level(object):
-    def __init__(self, name, filename):
+    # cache=False keeps the compiled level in memory only, for levels that won't be around for long (benchmarks,
+    # generated test levels). Levels outside LEVEL_DIR are never cached on disk either way.
+    def __init__(self, name, filename, cache=True):
         self.name = name
         self.filename = filename
+        self.cache = cache
+        self._compiled = None
+        self._compiled_stamp = None
+
+    @property
+    def fullpath(self):
+        return os.path.join(LEVEL_DIR, self.filename)
 
     def load(self):
         level = []
-        fullpath = os.path.join('.', 'assets', 'levels', self.filename)
 
-        with open(fullpath, 'r') as fh:
+        with open(self.fullpath, 'r') as fh:
             reader = csv.reader(fh, delimiter=',')
             for row in reader:
                 level.append(row)
         return level
 
+    def cache_path(self):
+        # Where the compiled level is cached, or None if it isn't. Only levels under LEVEL_DIR are cached, named after
+        # their path inside it, so every cache file belongs to a level that ships with the game.
+        if not self.cache:
+            return None
+        level_dir = os.path.abspath(LEVEL_DIR)
+        source = os.path.abspath(self.fullpath)
+        if not source.startswith(level_dir + os.sep):
+            return None
+        relpath = os.path.relpath(source, level_dir)
+        return os.path.join(CACHE_DIR, relpath.replace(os.sep, '.') + '.bin')
+
+    def compile(self):
+        # Parses the CSV source and writes the compiled level to the cache. If the cache can't be written the
+        # compiled level is still returned, it just won't survive past this process.
+        stat = os.stat(self.fullpath)
+        compiled = CompiledLevel.from_grid(self.load())
+        cache_path = self.cache_path()
+        if cache_path is None:
+            return compiled
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Several processes (or games in one process) can be compiling the same level at once, so each writes its
+            # own temporary file
+            tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as fh:
+                fh.write(compiled.pack(stat.st_mtime_ns, stat.st_size))
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+        return compiled
+
+    def _read_cache(self, mtime, size):
+        cache_path = self.cache_path()
+        if cache_path is None:
+            return None
+        try:
+            with open(cache_path, 'rb') as fh:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    return CompiledLevel.unpack(buf, mtime, size)
+        except (OSError, ValueError):
+            # Missing, empty or unreadable cache file
+            return None
+
+    def compiled(self):
+        # The compiled level, from memory if the source hasn't changed, then from the on-disk cache, and only
+        # parsing the CSV when neither is up to date
+        stat = os.stat(self.fullpath)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if self._compiled is not None and self._compiled_stamp == stamp:
+            return self._compiled
+
+        compiled = self._read_cache(*stamp)
+        if compiled is None:
+            compiled = self.compile()
+        self._compiled = compiled
+        self._compiled_stamp = stamp
+        return compiled
+
+
 class LevelManager(object):
-    def __init__(self):
+    def __init__(self, levels=None):
         self.current_level = 0
-        self.levels = [
-            Level('Network', 'level1 - network.level'),
-            Level('Harddrive', 'level2 - harddrive.level'),
-            Level('CPU', 'level3 - cpu.level')
-        ]
+        if levels is None:
+            levels = [
+                Level('Network', 'level1 - network.level'),
+                Level('Harddrive', 'level2 - harddrive.level'),
+                Level('CPU', 'level3 - cpu.level')
+            ]
+        self.levels = levels
+        # Futures for levels being read in the background, by level index
+        self.prefetched = {}
+        # The next level's PreparedLevel while it's being built over idle frames, as (level index, steps), and the
+        # finished ones by level index
+        self.preparing = None
+        self.ready = {}
 
     def is_final_level(self):
         return self.current_level == len(self.levels) - 1
@@ -33,3 +202,71 @@ class LevelManager(object):
 
     def next_level(self):
         self.current_level += 1
+
+    def prepared(self, prepare_steps):
+        # The current level ready to play. If prepare_ahead already built it that's it, if it got part way there the
+        # rest is done now. Otherwise it's prepared from scratch, after waiting for the worker to finish reading it if
+        # it was prefetched, so prepare_steps finds the compiled level already in memory.
+        index = self.current_level
+        level = self.get_level()
+        ready = self.ready.pop(index, None)
+        # The source can have changed since, in which case it's out of date
+        if ready is not None and ready.compiled is level.compiled():
+            return ready
+        future = self.prefetched.pop(index, None)
+        if future is not None:
+            future.result()
+        if self.preparing is not None and self.preparing[0] == index:
+            steps = self.preparing[1]
+            self.preparing = None
+        else:
+            steps = prepare_steps(level)
+        return run_steps(steps)
+
+    def prepare_ahead(self, prepare_steps, deadline):
+        # Builds the next level's PreparedLevel a step at a time until time.perf_counter() reaches deadline, carrying
+        # on where it left off the next time it's called. Nothing happens until the worker has read the level.
+        index = self.current_level + 1
+        if index >= len(self.levels) or index in self.ready:
+            return
+        future = self.prefetched.get(index)
+        if future is not None and not future.done():
+            return
+        if self.preparing is None or self.preparing[0] != index:
+            self.preparing = (index, prepare_steps(self.levels[index]))
+        steps = self.preparing[1]
+        while time.perf_counter() < deadline:
+            try:
+                next(steps)
+            except StopIteration as done:
+                self.ready[index] = done.value
+                self.preparing = None
+                return
+
+    def prefetch_next(self):
+        # Starts reading the next level on the worker thread while the current one is being played. The worker only
+        # does the file I/O and decoding, anything that makes surfaces has to stay on the main thread.
+        index = self.current_level + 1
+        if index >= len(self.levels) or index in self.prefetched:
+            return
+        self.prefetched[index] = _prefetch_executor().submit(self.levels[index].compiled)
+
+
+def run_steps(steps):
+    # Runs a generator of steps to the end and returns what it returns
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+
+_executor = None
+
+
+def _prefetch_executor():
+    # One worker for the whole process is plenty, only the next level is ever prepared ahead
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='level-prefetch')
+    return _executor
@@ -1,16 +1,58 @@
+import argparse
+
 import pygame as pg
 
-from game import Game
+from game import Game, GameState
+from replay import InputLog, InputRecorder, ReplayInput, fast_forward
+from simulation import DeviceInput
+
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Crypto Crime Fighter')
+    parser.add_argument('--record', metavar='PATH', help='record every tick of input to this file')
+    parser.add_argument('--replay', metavar='PATH', help='play back a recording made with --record')
+    parser.add_argument('--fast', action='store_true',
+                        help='with --replay, play it back headlessly as fast as possible instead of in real time')
+    parser.add_argument('--profile', action='store_true', help='with --fast, print where the time went')
+    args = parser.parse_args(argv)
 
-def main():
     wind_width = 1680
     wind_height = 1088
     game_width = 1280
     game_height = wind_height
     tilesize = 32
 
+    if args.replay:
+        log = InputLog.load(args.replay)
+        main_game = Game(
+            wind_width, wind_height, game_width, game_height, tilesize, headless=args.fast,
+            input_source=ReplayInput(log), seed=log.seed
+        )
+        if args.fast:
+            ticks, seconds, totals = fast_forward(main_game, log, args.profile)
+            print(f'{ticks} ticks ({ticks / log.tick_rate:.1f}s of play) in {seconds:.2f}s, '
+                  f'{ticks / max(seconds, 1e-9):.0f} ticks/s')
+            for name, ms in sorted(totals.items(), key=lambda item: -item[1]):
+                print(f'{name:<24} {ms:10.1f} ms {ms / max(ticks, 1):8.3f} ms/tick')
+            pg.quit()
+            return
+        # Straight into the recorded game, there's nothing to click through in the menus
+        main_game.state = GameState.NEWGAME
+        main_game.quickload = False
+        main_game.run_game()
+        return
+
     main_game = Game(wind_width, wind_height, game_width, game_height, tilesize)
+    if args.record:
+        recorder = InputRecorder(DeviceInput(), main_game.tick_rate)
+        main_game.input = recorder
+        main_game.quickload = False
+        try:
+            main_game.run_game()
+        finally:
+            # exit_game leaves through sys.exit, so this still runs when the window is closed
+            recorder.save(args.record)
+        return
 
     main_game.run_game()
 
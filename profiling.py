@@ -0,0 +1,160 @@
+import math
+import time
+from collections import deque
+
+import pygame as pg
+
+from hud import text_renderer
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(math.ceil(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class _NullScope(object):
+    # Handed out while profiling is off so a scope costs no more than entering and leaving an empty with block
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+class _Scope(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class Profiler(object):
+    # Named timing scopes collected per frame, with a rolling history of each one for the overlay.
+    # Nothing is timed or stored while it's disabled.
+    def __init__(self, history=120):
+        self.enabled = False
+        self.history_length = history
+        self.history = {}
+        self.counters = {}
+        self.current = {}
+        self.frame_start = 0
+        # Whether update_group times each sprite class on its own. That's two clock reads per sprite, which is more
+        # than some updates cost, so benchmarks turn it off.
+        self.split_groups = True
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.history.clear()
+        self.counters = {}
+        self.current = {}
+
+    def scope(self, name):
+        if not self.enabled:
+            return _NULL_SCOPE
+        return _Scope(self, name)
+
+    def add(self, name, ms):
+        self.current[name] = self.current.get(name, 0) + ms
+
+    def update_group(self, group):
+        # Same as group.update(), but when profiling the time is split up by sprite class (e.g. 'update.Enemy')
+        if not self.enabled or not self.split_groups:
+            group.update()
+            return
+        perf = time.perf_counter
+        for sprite in group.sprites():
+            start = perf()
+            sprite.update()
+            self.add('update.' + type(sprite).__name__, (perf() - start) * 1000)
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.current = {}
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self, **counters):
+        if not self.enabled:
+            return
+        self.current['frame'] = (time.perf_counter() - self.frame_start) * 1000
+        for name, ms in self.current.items():
+            samples = self.history.get(name)
+            if samples is None:
+                samples = self.history[name] = deque(maxlen=self.history_length)
+            samples.append(ms)
+        self.counters = counters
+
+    def average(self, name):
+        samples = self.history.get(name)
+        if not samples:
+            return 0.0
+        return sum(samples) / len(samples)
+
+
+class ProfilerOverlay(object):
+    # Draws the profiler's numbers and a frame time graph into a box in the sidebar
+    def __init__(self, profiler, rect, budget_ms):
+        self.profiler = profiler
+        self.rect = pg.Rect(rect)
+        # The graph is scaled so the frame budget sits half way up
+        self.budget_ms = budget_ms
+        self.font = text_renderer.font(20)
+        self.visible = False
+
+    def draw(self, surface, background):
+        # Returns the dirty rects, including the one that clears the overlay away after it has been turned off
+        if not self.profiler.enabled:
+            if self.visible:
+                self.visible = False
+                surface.blit(background, self.rect, self.rect)
+                return [self.rect]
+            return []
+        self.visible = True
+
+        profiler = self.profiler
+        surface.blit(background, self.rect, self.rect)
+        pg.draw.rect(surface, (20, 20, 20), self.rect)
+
+        x = self.rect.x + 6
+        y = self.rect.y + 4
+        white = (255, 255, 255)
+        lines = [f"frame {profiler.average('frame'):6.2f} ms"]
+        names = sorted(name for name in profiler.history if name != 'frame')
+        lines += [f'{name:<16} {profiler.average(name):6.2f} ms' for name in names]
+        lines += [f'{name:<16} {value}' for name, value in profiler.counters.items()]
+        for line in lines:
+            if y > self.rect.bottom - 110:
+                break
+            surface.blit(self.font.render(line, True, white), (x, y))
+            y += self.font.get_linesize()
+
+        # Rolling frame time graph along the bottom of the box
+        graph = pg.Rect(self.rect.x + 4, self.rect.bottom - 104, self.rect.width - 8, 100)
+        pg.draw.rect(surface, (60, 60, 60), graph, 1)
+        budget_y = graph.bottom - graph.height // 2
+        pg.draw.line(surface, (120, 0, 0), (graph.left, budget_y), (graph.right - 1, budget_y))
+        samples = profiler.history.get('frame')
+        if samples and len(samples) > 1:
+            step = graph.width / (profiler.history_length - 1)
+            scale = (graph.height / 2) / self.budget_ms
+            points = [
+                (graph.left + i * step, max(graph.top, graph.bottom - 1 - ms * scale))
+                for i, ms in enumerate(samples)
+            ]
+            pg.draw.lines(surface, (0, 220, 0), False, points)
+
+        return [self.rect]
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class RegionMap(object):
+    # Simulation level of detail. The level is split into square regions, and enemies outside the regions around the
+    # camera view are put to sleep: they're taken out of the per-tick update and their timers stop, so the cost of a
+    # tick follows what's going on near the player rather than the size of the level.
+    #
+    # The active area is only recomputed from the camera, which moves once per tick, and enemies are checked against
+    # it once per tick, so which enemies are awake on any given tick is the same on every run.
+    def __init__(self, game, region_size, margin):
+        self.game = game
+        self.region_size = region_size
+        # How far past the edges of the view enemies stay awake, in pixels
+        self.margin = margin
+        # (first col, first row, last col, last row) of the active regions
+        self.bounds = None
+        # Sleeping enemies by the region they fell asleep in. They don't move while asleep, so that never goes stale.
+        self.sleepers = {}
+
+        self.sleeps = 0
+        self.wakes = 0
+
+    def __len__(self):
+        return sum(len(enemies) for enemies in self.sleepers.values())
+
+    def region_of(self, rect):
+        return rect.centerx // self.region_size, rect.centery // self.region_size
+
+    def is_active(self, region):
+        first_col, first_row, last_col, last_row = self.bounds
+        return first_col <= region[0] <= last_col and first_row <= region[1] <= last_row
+
+    def _active_bounds(self):
+        area = self.game.camera.view.inflate(self.margin * 2, self.margin * 2)
+        size = self.region_size
+        return area.left // size, area.top // size, (area.right - 1) // size, (area.bottom - 1) // size
+
+    def update(self):
+        # Awake enemies wander about, so any that left the active area are put to sleep every tick, not only when the
+        # area itself moves. Sleepers are only woken when the area moves into their region.
+        bounds = self._active_bounds()
+        moved = bounds != self.bounds
+        self.bounds = bounds
+
+        for enemy in self._leaving():
+            self.sleep(enemy)
+
+        if not moved:
+            return
+        first_col, first_row, last_col, last_row = bounds
+        for region in sorted(self.sleepers):
+            if first_col <= region[0] <= last_col and first_row <= region[1] <= last_row:
+                for enemy in self.sleepers.pop(region):
+                    enemy.wake()
+                    self.wakes += 1
+
+    def _leaving(self):
+        # The awake enemies outside the active area. Enemies that are hit or chasing the player stay awake wherever
+        # they are, or one woken by a shot from out of range would drop straight back to sleep. The active group only
+        # has the enemies that update themselves, the swarm's are found from its arrays all at once.
+        leaving = [
+            enemy for enemy in self.game.active.sprites()
+            if not enemy.hit_state and not enemy.chasing and not self.is_active(self.region_of(enemy.rect))
+        ]
+        swarm = self.game.swarm
+        if swarm is not None:
+            slots = np.flatnonzero(swarm.alive & ~swarm.asleep & ~swarm.hit & ~swarm.chasing)
+            region = swarm.centers(slots) // self.region_size
+            first_col, first_row, last_col, last_row = self.bounds
+            inside = ((region[:, 0] >= first_col) & (region[:, 0] <= last_col)
+                      & (region[:, 1] >= first_row) & (region[:, 1] <= last_row))
+            leaving += [swarm.sprites[slot] for slot in slots[~inside].tolist()]
+        return leaving
+
+    def sleep(self, enemy):
+        self.sleepers.setdefault(self.region_of(enemy.rect), []).append(enemy)
+        enemy.sleep()
+        self.sleeps += 1
+
+    def wake(self, enemy):
+        # Wakes a single enemy early, e.g. one that got shot from out of range
+        region = self.region_of(enemy.rect)
+        sleepers = self.sleepers[region]
+        sleepers.remove(enemy)
+        if not sleepers:
+            del self.sleepers[region]
+        enemy.wake()
+        self.wakes += 1
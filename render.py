@@ -0,0 +1,129 @@
+from collections import OrderedDict
+
+import pygame as pg
+
+
+class StaticLayer(object):
+    # Composites everything that never moves (floor tiles, walls) into one surface once per level. The result is used
+    # as the background that sprites are cleared against, so none of it has to be redrawn or marked dirty per frame.
+    def __init__(self, size, base=None):
+        # base, if given, is copied as the bottom layer instead of starting from a blank surface
+        self.size = size
+        self.base = base
+        self.pending = []
+
+    def add(self, image, pos):
+        self.pending.append((image, pos))
+
+    def add_sprite(self, sprite):
+        self.add(sprite.image, sprite.rect)
+
+    def build(self):
+        if self.base is not None:
+            surface = self.base.copy()
+        else:
+            surface = pg.Surface(self.size).convert()
+        surface.blits(self.pending, doreturn=False)
+        self.pending = []
+        return surface
+
+
+class ChunkedTilemap(object):
+    # The static part of a level (floor and walls) cut into square chunks of tiles. A chunk is pre-rendered the first
+    # time it comes into view and kept until the map goes over its memory budget, least recently used first, so drawing
+    # the background costs the same on a huge level as on a small one.
+    def __init__(self, size, tile_size, floor_image, tiles, chunk_tiles=16, budget=32 * 1024 * 1024):
+        # tiles is a list of (image, col, row) drawn on top of the floor
+        self.size = size
+        self.tile_size = tile_size
+        self.chunk_size = chunk_tiles * tile_size
+        self.floor_image = floor_image
+        self.budget = budget
+
+        # What goes into each chunk, positioned relative to the chunk
+        self.contents = {}
+        for image, col, row in tiles:
+            key = (col // chunk_tiles, row // chunk_tiles)
+            pos = (col * tile_size - key[0] * self.chunk_size, row * tile_size - key[1] * self.chunk_size)
+            self.contents.setdefault(key, []).append((image, pos))
+
+        self.floor = None
+        self.chunks = OrderedDict()
+        self.bytes = 0
+
+        self.builds = 0
+        self.evictions = 0
+
+    def _floor(self):
+        # Every chunk starts out as a copy of the same tiled floor
+        if self.floor is None:
+            layer = StaticLayer((self.chunk_size, self.chunk_size))
+            for x in range(0, self.chunk_size, self.tile_size):
+                for y in range(0, self.chunk_size, self.tile_size):
+                    layer.add(self.floor_image, (x, y))
+            self.floor = layer.build()
+        return self.floor
+
+    def chunk(self, col, row):
+        key = (col, row)
+        surface = self.chunks.get(key)
+        if surface is not None:
+            self.chunks.move_to_end(key)
+            return surface
+
+        layer = StaticLayer((self.chunk_size, self.chunk_size), self._floor())
+        for image, pos in self.contents.get(key, ()):
+            layer.add(image, pos)
+        surface = layer.build()
+        self.builds += 1
+
+        self.chunks[key] = surface
+        self.bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+        while self.bytes > self.budget and len(self.chunks) > 1:
+            _, evicted = self.chunks.popitem(last=False)
+            self.bytes -= evicted.get_width() * evicted.get_height() * evicted.get_bytesize()
+            self.evictions += 1
+        return surface
+
+    def chunks_in(self, view):
+        size = self.chunk_size
+        for row in range(max(view.top, 0) // size, (min(view.bottom, self.size[1]) - 1) // size + 1):
+            for col in range(max(view.left, 0) // size, (min(view.right, self.size[0]) - 1) // size + 1):
+                yield col, row
+
+    def draw(self, surface, view):
+        # Draws the part of the map inside view (a rect in world coordinates) with view's top left at surface's
+        size = self.chunk_size
+        surface.blits([
+            (self.chunk(col, row), (col * size - view.x, row * size - view.y))
+            for col, row in self.chunks_in(view)
+        ], doreturn=False)
+
+    def stats(self):
+        return {
+            'chunks': len(self.chunks),
+            'builds': self.builds,
+            'evictions': self.evictions,
+            'bytes': self.bytes,
+        }
+
+
+class ViewLayer(object):
+    # Draws sprites through a camera, skipping any that are out of view. Like RenderUpdates it remembers where it drew
+    # so clear() can erase that on the next frame, and both old and new rects are reported as dirty.
+    def __init__(self, camera):
+        self.camera = camera
+        self.drawn = []
+
+    def draw(self, surface, sprites):
+        view = self.camera.view
+        x, y = view.topleft
+        rects = surface.blits([
+            (sprite.image, sprite.rect.move(-x, -y)) for sprite in sprites if view.colliderect(sprite.rect)
+        ])
+        dirty = self.drawn + rects
+        self.drawn = rects
+        return dirty
+
+    def clear(self, surface, background):
+        surface.blits([(background, rect, rect) for rect in self.drawn], doreturn=False)
@@ -0,0 +1,187 @@
+import struct
+import time
+
+import pygame as pg
+
+from simulation import InputState, KeyState
+
+# Gameplay only ever reads these keys, so they're all a recording keeps
+KEYS = (pg.K_LEFT, pg.K_RIGHT, pg.K_UP, pg.K_DOWN)
+
+MAGIC = b'CCFREC'
+VERSION = 1
+# magic, version, tick rate, seed, number of games
+HEADER = struct.Struct('<6sBHQI')
+# number of runs in a game
+GAME = struct.Struct('<I')
+# ticks, keys held (a bit per entry in KEYS), mouse x, mouse y, mouse buttons (a bit each)
+RUN = struct.Struct('<IBhhB')
+
+
+def _pack_state(keys, mouse_pos, mouse_buttons):
+    key_bits = 0
+    for bit, key in enumerate(KEYS):
+        if keys[key]:
+            key_bits |= 1 << bit
+    button_bits = 0
+    for bit, pressed in enumerate(mouse_buttons):
+        if pressed:
+            button_bits |= 1 << bit
+    x = max(-32768, min(32767, int(mouse_pos[0])))
+    y = max(-32768, min(32767, int(mouse_pos[1])))
+    return key_bits, x, y, button_bits
+
+
+def _unpack_state(key_bits, x, y, button_bits):
+    keys = [key for bit, key in enumerate(KEYS) if key_bits & (1 << bit)]
+    buttons = tuple(bool(button_bits & (1 << bit)) for bit in range(3))
+    return InputState(keys, (x, y), buttons)
+
+
+class InputLog(object):
+    # The input every tick of a session saw, and the seed it ran on, which together replay it exactly. Input tends to
+    # stay the same for many ticks in a row, so each game is stored as runs of (ticks, state) and a session of several
+    # minutes is only a few kilobytes.
+    def __init__(self, seed, tick_rate):
+        self.seed = seed
+        self.tick_rate = tick_rate
+        # One list of [ticks, key bits, x, y, button bits] runs per new game started during the session
+        self.games = []
+
+    def ticks(self, index):
+        return sum(run[0] for run in self.games[index])
+
+    def states(self, index):
+        # The InputState of every tick of a game, in order
+        for count, key_bits, x, y, button_bits in self.games[index]:
+            state = _unpack_state(key_bits, x, y, button_bits)
+            for _ in range(count):
+                yield state
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            fh.write(HEADER.pack(MAGIC, VERSION, self.tick_rate, self.seed, len(self.games)))
+            for runs in self.games:
+                fh.write(GAME.pack(len(runs)))
+                fh.write(b''.join(RUN.pack(*run) for run in runs))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fh:
+            buf = fh.read()
+        magic, version, tick_rate, seed, games = HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} input recording')
+        log = cls(seed, tick_rate)
+        offset = HEADER.size
+        for _ in range(games):
+            count, = GAME.unpack_from(buf, offset)
+            offset += GAME.size
+            log.games.append([list(run) for run in RUN.iter_unpack(buf[offset:offset + count * RUN.size])])
+            offset += count * RUN.size
+        return log
+
+
+class InputRecorder(object):
+    # Wraps another input source (normally DeviceInput) and logs the state it reads once per tick. The game is handed
+    # that same logged state for the whole tick rather than whatever the devices say by the time it asks, so what's
+    # recorded is exactly what the game saw.
+    def __init__(self, source, tick_rate):
+        self.source = source
+        self.log = None
+        self.tick_rate = tick_rate
+        self.runs = None
+        self.state = InputState()
+        self.keys = KeyState(self.state.keys)
+
+    def start(self, seed):
+        self.source.start(seed)
+        if self.log is None:
+            self.log = InputLog(seed, self.tick_rate)
+        self.runs = []
+        self.log.games.append(self.runs)
+
+    def poll(self):
+        source = self.source
+        source.poll()
+        packed = _pack_state(source.get_pressed(), source.get_mouse_pos(), source.get_mouse_pressed())
+        runs = self.runs
+        if runs and tuple(runs[-1][1:]) == packed:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, *packed])
+            self.state = _unpack_state(*packed)
+            self.keys = KeyState(self.state.keys)
+
+    def get_pressed(self):
+        return self.keys
+
+    def get_mouse_pos(self):
+        return self.state.mouse_pos
+
+    def get_mouse_pressed(self):
+        return self.state.mouse_buttons
+
+    def save(self, path):
+        if self.log is not None:
+            self.log.save(path)
+
+
+class ReplayInput(object):
+    # Feeds a recording back to the game. Each new game plays the next game in the log, and once a game's input runs
+    # out nothing is pressed any more.
+    def __init__(self, log):
+        self.log = log
+        self.game_index = -1
+        self.states = iter(())
+        self.state = InputState()
+        self.keys = KeyState(self.state.keys)
+
+    def start(self, seed):
+        if seed != self.log.seed:
+            raise ValueError(f'recording was made with seed {self.log.seed}, not {seed}')
+        self.game_index += 1
+        self.states = self.log.states(self.game_index) if self.game_index < len(self.log.games) else iter(())
+
+    def poll(self):
+        state = next(self.states, None)
+        if state is None:
+            state = InputState()
+        if state is not self.state:
+            self.state = state
+            self.keys = KeyState(state.keys)
+
+    def get_pressed(self):
+        return self.keys
+
+    def get_mouse_pos(self):
+        return self.state.mouse_pos
+
+    def get_mouse_pressed(self):
+        return self.state.mouse_buttons
+
+
+def fast_forward(game, log, profile=False):
+    # Replays every game in the log headlessly as fast as possible. game has to be headless, made with the log's seed
+    # and a ReplayInput for it. Returns the number of ticks played, the wall time they took and, if profile is set,
+    # the total milliseconds spent in each of the game's profiler scopes.
+    if game.tick_rate != log.tick_rate:
+        raise ValueError(f'recording was made at {log.tick_rate} ticks per second, not {game.tick_rate}')
+    profiler = game.profiler
+    if profile and not profiler.enabled:
+        profiler.toggle()
+    totals = {}
+    ticks = 0
+    start = time.perf_counter()
+    for index in range(len(log.games)):
+        game.new_game()
+        for _ in range(log.ticks(index)):
+            profiler.begin_frame()
+            playing = game.step_tick()
+            ticks += 1
+            if profile:
+                for name, ms in profiler.current.items():
+                    totals[name] = totals.get(name, 0) + ms
+            if not playing:
+                break
+    return ticks, time.perf_counter() - start, totals
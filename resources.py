@@ -0,0 +1,136 @@
+import os
+from collections import OrderedDict
+
+import pygame as pg
+
+
+class ImageCache(object):
+    def __init__(self, base_path=os.path.join('.', 'assets', 'images')):
+        self.base_path = base_path
+        # Converted surfaces keyed by filename, and derived surfaces keyed by (filename, variant key)
+        self.surfaces = {}
+        self.variants = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.variant_hits = 0
+        self.variant_misses = 0
+
+    def _load(self, filename):
+        fullpath = os.path.join(self.base_path, filename)
+        try:
+            surface = pg.image.load(fullpath)
+        except pg.error:
+            raise RuntimeError(f'Unable to load image "{fullpath}". error: {pg.get_error()}')
+        return surface.convert_alpha()
+
+    def get(self, filename):
+        # The surfaces handed out here are shared between every sprite that uses them, so callers must
+        # treat them as read only. Anything that needs a modified copy should go through get_variant.
+        surface = self.surfaces.get(filename)
+        if surface is None:
+            self.misses += 1
+            surface = self._load(filename)
+            self.surfaces[filename] = surface
+        else:
+            self.hits += 1
+        return surface
+
+    def get_variant(self, filename, key, builder):
+        # builder takes the base surface and returns the derived one. It only runs the first time a key is asked for.
+        variant_key = (filename, key)
+        surface = self.variants.get(variant_key)
+        if surface is None:
+            self.variant_misses += 1
+            surface = builder(self.get(filename))
+            self.variants[variant_key] = surface
+        else:
+            self.variant_hits += 1
+        return surface
+
+    def preload(self, filenames):
+        for filename in filenames:
+            self.get(filename)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.variant_hits = 0
+        self.variant_misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'variant_hits': self.variant_hits,
+            'variant_misses': self.variant_misses,
+            'surfaces': len(self.surfaces),
+            'variants': len(self.variants),
+        }
+
+    def clear(self):
+        self.surfaces.clear()
+        self.variants.clear()
+        self.reset_stats()
+
+
+class RotationAtlas(object):
+    # Pre-rotated copies of a sprite in a fixed number of angle buckets. Frames are rotated the first time they are
+    # asked for and kept until the atlas goes over its memory budget, at which point the least recently used go first.
+    def __init__(self, images, buckets=360, budget=16 * 1024 * 1024):
+        # images maps a state name (e.g. 'normal', 'hit') to the unrotated surface for that state
+        self.images = images
+        self.buckets = buckets
+        self.step = 360 / buckets
+        self.budget = budget
+
+        self.frames = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bucket(self, angle):
+        return int(round(angle / self.step)) % self.buckets
+
+    def get(self, state, angle):
+        key = (state, self.bucket(angle))
+        surface = self.frames.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = pg.transform.rotate(self.images[state], key[1] * self.step)
+        self.frames[key] = surface
+        self.bytes += self._size(surface)
+        while self.bytes > self.budget and len(self.frames) > 1:
+            _, evicted = self.frames.popitem(last=False)
+            self.bytes -= self._size(evicted)
+            self.evictions += 1
+        return surface
+
+    def fill(self, states=None):
+        for state in states or self.images:
+            for bucket in range(self.buckets):
+                self.get(state, bucket * self.step)
+
+    def _size(self, surface):
+        width, height = surface.get_size()
+        return width * height * surface.get_bytesize()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'frames': len(self.frames),
+            'bytes': self.bytes,
+        }
+
+
+# Shared by every Game in the process. Surfaces can only be converted once a display mode has been set,
+# so nothing is loaded until the first request.
+image_cache = ImageCache()
@@ -0,0 +1,44 @@
+import heapq
+
+
+class Timer(object):
+    # Handle for a scheduled callback, cancel() stops it from firing
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    # Deadlines in gameplay milliseconds, kept in a heap so each tick only looks at the timers that are actually due
+    # instead of every entity checking its own. Timers due at the same time fire in the order they were scheduled.
+    def __init__(self):
+        self.queue = []
+        self.sequence = 0
+        self.fired = 0
+
+    def schedule(self, when, callback):
+        timer = Timer(when, callback)
+        heapq.heappush(self.queue, (when, self.sequence, timer))
+        self.sequence += 1
+        return timer
+
+    def run(self, now):
+        # Fires everything due at or before now. Callbacks may schedule new timers, and those fire in this same call
+        # if they're already due.
+        queue = self.queue
+        while queue and queue[0][0] <= now:
+            _, _, timer = heapq.heappop(queue)
+            if timer.cancelled:
+                continue
+            self.fired += 1
+            timer.callback()
+
+    def clear(self):
+        self.queue = []
+
+    def __len__(self):
+        return len(self.queue)
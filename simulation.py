@@ -0,0 +1,131 @@
+import pygame as pg
+
+
+class RealClock(object):
+    # Wall clock time, used to pace frames when there's a window to draw to
+    def __init__(self):
+        self.clock = pg.time.Clock()
+
+    def get_ticks(self):
+        return pg.time.get_ticks()
+
+    def tick(self, fps):
+        return self.clock.tick(fps)
+
+    def reset(self):
+        # Forget the time spent since the last tick, e.g. while sitting in a menu
+        self.clock.tick()
+
+
+class SimulatedClock(object):
+    # Time only moves when tick() or advance() is called, and tick() never sleeps, so a headless game can run as fast
+    # as the CPU allows while every timer still sees the frame rate it expects.
+    def __init__(self, start=0):
+        self.now = start
+
+    def get_ticks(self):
+        return int(self.now)
+
+    def advance(self, ms):
+        self.now += ms
+
+    def tick(self, fps):
+        ms = 1000 / fps
+        self.advance(ms)
+        return ms
+
+    def reset(self):
+        pass
+
+
+class FixedTimestep(object):
+    # Turns however much real time a frame took into a whole number of fixed-length simulation ticks. Gameplay only
+    # ever advances in ticks, so the results don't depend on the frame rate, only on the input each tick sees.
+    def __init__(self, tick_rate, max_ticks=5):
+        self.tick_ms = 1000 / tick_rate
+        # Upper bound on ticks per frame. If a frame takes longer than that the backlog is dropped and the game
+        # slows down instead of spending ever longer catching up.
+        self.max_ticks = max_ticks
+        self.accumulator = 0
+
+    def reset(self):
+        self.accumulator = 0
+
+    def advance(self, elapsed_ms):
+        self.accumulator += elapsed_ms
+        ticks = int(self.accumulator // self.tick_ms)
+        if ticks > self.max_ticks:
+            self.accumulator = 0
+            return self.max_ticks
+        self.accumulator -= ticks * self.tick_ms
+        return ticks
+
+
+class InputState(object):
+    def __init__(self, keys=(), mouse_pos=(0, 0), mouse_buttons=(False, False, False)):
+        self.keys = frozenset(keys)
+        self.mouse_pos = tuple(mouse_pos)
+        self.mouse_buttons = tuple(mouse_buttons)
+
+
+class KeyState(object):
+    # Indexed by key constant like the sequence pg.key.get_pressed returns
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+
+class DeviceInput(object):
+    # Reads the real keyboard and mouse
+    def start(self, seed):
+        # Called by Game.new_game with the seed the new game runs on
+        pass
+
+    def poll(self):
+        pass
+
+    def get_pressed(self):
+        return pg.key.get_pressed()
+
+    def get_mouse_pos(self):
+        return pg.mouse.get_pos()
+
+    def get_mouse_pressed(self):
+        return pg.mouse.get_pressed()
+
+
+class ScriptedInput(object):
+    # Plays back input from a script instead of the devices. The script is either a list of InputStates, one per frame
+    # (the last one repeats once it runs out), or a callable taking (frame, game) and returning an InputState.
+    def __init__(self, script, game=None):
+        self.script = script
+        self.game = game
+        self.frame = -1
+        self.state = InputState()
+        self.keys = KeyState(self.state.keys)
+
+    def start(self, seed):
+        # Every new game plays the script from the beginning
+        self.frame = -1
+
+    def poll(self):
+        self.frame += 1
+        if callable(self.script):
+            state = self.script(self.frame, self.game)
+        elif self.script:
+            state = self.script[min(self.frame, len(self.script) - 1)]
+        else:
+            state = InputState()
+        self.state = state
+        self.keys = KeyState(state.keys)
+
+    def get_pressed(self):
+        return self.keys
+
+    def get_mouse_pos(self):
+        return self.state.mouse_pos
+
+    def get_mouse_pressed(self):
+        return self.state.mouse_buttons
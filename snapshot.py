@@ -0,0 +1,364 @@
+import struct
+
+import numpy as np
+
+from entities import Collectable, Enemy
+from regions import RegionMap
+from scheduler import Scheduler, Timer
+from swarm import EnemySwarm
+
+# A snapshot is everything that changes while a level is played, packed into a flat byte string. The level itself
+# (walls, tilemap, colliders) isn't in it, only which level it was, and neither is the flow field since it rebuilds
+# to the same thing on demand. The line of sight cache is, because it keeps whatever the first ray cast from each tile
+# saw. Restoring a snapshot and playing on with the same input gives exactly the ticks the original game would have
+# played.
+#
+# Sprites are written as ids rather than objects: the player is 0, then the enemies and then the collectables, each
+# in the order of their group. Group orders matter because they decide who updates, shoots and gets hit first.
+
+MAGIC = b'CCFSNP'
+VERSION = 1
+
+# magic, version, seed, tick count, gameplay clock, fixed timestep backlog, level index, camera x, camera y,
+# number of level clear ticks
+HEADER = struct.Struct('<6sBQQddIiiI')
+# Mersenne Twister state: 624 words and the position in them, then whether there's a cached gauss value and what it is
+RNG = struct.Struct('<625IBd')
+# x, y, w, h, rotation, health, max health, damage, can shoot, last shot, hit state, hit state start, score,
+# shots fired, damage taken, collectables picked
+PLAYER = struct.Struct('<iiiidiiiBqBqiIII')
+# x, y, health, hit state, hit state start, hit state end (-1 if none), last action, action timer, rand moving,
+# chasing, asleep, move x, move y, swarm slot (-1 if none)
+ENEMY = struct.Struct('<iiiBqqqiBBBddi')
+# x, y, reward health, reward damage
+COLLECTABLE = struct.Struct('<iiii')
+# when, sequence, owner id, callback
+TIMER = struct.Struct('<qQIB')
+# next sequence number, timers fired, number of pending timers
+SCHEDULER = struct.Struct('<QQI')
+# capacity, next serial, live bullets, free slots
+BULLETS = struct.Struct('<IQII')
+# has bounds, first col, first row, last col, last row, sleeps, wakes, regions with sleepers
+REGIONS = struct.Struct('<BiiiiQQI')
+# col, row, sleepers
+REGION = struct.Struct('<iiI')
+# has a target, target col, target row, cached tiles
+SIGHT = struct.Struct('<BiiI')
+# col, row, visible
+SIGHT_TILE = struct.Struct('<iiB')
+# capacity, live slots, free slots, PCG64 state (high, low), increment (high, low), has a cached uint32, the uint32
+SWARM = struct.Struct('<IIIQQQQBI')
+COUNT = struct.Struct('<I')
+
+# Every callback the scheduler can hold, by name on the sprite that owns it
+CALLBACKS = ('_act', '_end_hit_state')
+SWARM_ARRAYS = ('pos', 'size', 'move_dir', 'speed', 'sight_range', 'attack_range', 'rand_action_chance',
+                'next_action', 'action_timer', 'hit', 'asleep', 'rand_moving', 'chasing')
+
+_MASK_64 = (1 << 64) - 1
+
+
+class _Writer(object):
+    def __init__(self):
+        self.chunks = []
+
+    def pack(self, fmt, *values):
+        self.chunks.append(fmt.pack(*values))
+
+    def ids(self, ids):
+        self.chunks.append(COUNT.pack(len(ids)))
+        self.chunks.append(np.asarray(ids, dtype=np.uint32).tobytes())
+
+    def array(self, array):
+        self.chunks.append(np.ascontiguousarray(array).tobytes())
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+class _Reader(object):
+    def __init__(self, buf):
+        self.buf = buf
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.buf, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def records(self, fmt, count):
+        end = self.offset + fmt.size * count
+        records = list(fmt.iter_unpack(self.buf[self.offset:end]))
+        self.offset = end
+        return records
+
+    def ids(self):
+        count, = self.unpack(COUNT)
+        return self.array(np.uint32, (count,)).tolist()
+
+    def array(self, dtype, shape):
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        array = np.frombuffer(self.buf, dtype=dtype, count=count, offset=self.offset).reshape(shape).copy()
+        self.offset += dtype.itemsize * count
+        return array
+
+
+def _sprites(game):
+    return [game.player] + game.enemies.sprites() + game.collectables.sprites()
+
+
+def snapshot(game):
+    writer = _Writer()
+    sprites = _sprites(game)
+    ids = {sprite: index for index, sprite in enumerate(sprites)}
+    camera = game.camera.view
+
+    writer.pack(HEADER, MAGIC, VERSION, game.seed, game.tick_count, game.clock.now, game.timestep.accumulator,
+                game.level_manager.current_level, camera.x, camera.y, len(game.level_ticks))
+    writer.array(np.asarray(game.level_ticks, dtype=np.uint64))
+
+    _, words, gauss = game.rng.getstate()
+    writer.pack(RNG, *words, gauss is not None, gauss or 0.0)
+
+    player = game.player
+    rect = player.rect
+    writer.pack(PLAYER, rect.x, rect.y, rect.w, rect.h, getattr(player, 'rotation', 0.0), player.health,
+                player.max_health, player.damage, player.can_shoot, player.last_shot, player.hit_state,
+                player.hit_state_start, player.score, player.shots_fired, player.damage_taken,
+                player.collectables_picked)
+
+    enemies = game.enemies.sprites()
+    writer.pack(COUNT, len(enemies))
+    writer.chunks.extend(
+        ENEMY.pack(
+            enemy.rect.x, enemy.rect.y, enemy.health, enemy.hit_state, enemy.hit_state_start,
+            -1 if enemy.hit_state_end is None else enemy.hit_state_end, enemy.last_action, enemy.action_timer,
+            enemy.rand_moving, enemy.chasing, enemy.asleep, enemy.move_dir[0], enemy.move_dir[1],
+            -1 if enemy.slot is None else enemy.slot
+        )
+        for enemy in enemies
+    )
+
+    collectables = game.collectables.sprites()
+    writer.pack(COUNT, len(collectables))
+    writer.chunks.extend(
+        COLLECTABLE.pack(item.rect.x, item.rect.y, item.reward_health, item.reward_damage) for item in collectables
+    )
+
+    writer.ids([ids[sprite] for sprite in game.entities])
+    writer.ids([ids[sprite] for sprite in game.active])
+
+    # Cancelled timers never fire, so they're left out. What's left is sorted, which is also a valid heap.
+    scheduler = game.scheduler
+    timers = sorted((entry for entry in scheduler.queue if not entry[2].cancelled), key=lambda entry: entry[:2])
+    writer.pack(SCHEDULER, scheduler.sequence, scheduler.fired, len(timers))
+    for when, sequence, timer in timers:
+        callback = timer.callback
+        owner = getattr(callback, '__self__', None)
+        if owner not in ids or callback.__name__ not in CALLBACKS:
+            raise ValueError(f"can't snapshot a timer for {callback!r}")
+        writer.pack(TIMER, when, sequence, ids[owner], CALLBACKS.index(callback.__name__))
+
+    bullets = game.bullets
+    live = np.flatnonzero(bullets.alive)
+    writer.pack(BULLETS, bullets.capacity, bullets.next_serial, len(live), len(bullets.free))
+    writer.array(live.astype(np.uint32))
+    for array in (bullets.pos, bullets.prev, bullets.vel, bullets.damage, bullets.target, bullets.serial):
+        writer.array(array[live])
+    writer.array(np.asarray(bullets.free, dtype=np.uint32))
+
+    regions = game.regions
+    bounds = regions.bounds or (0, 0, 0, 0)
+    writer.pack(REGIONS, regions.bounds is not None, *bounds, regions.sleeps, regions.wakes, len(regions.sleepers))
+    for region, sleepers in regions.sleepers.items():
+        writer.pack(REGION, region[0], region[1], len(sleepers))
+        writer.array(np.asarray([ids[enemy] for enemy in sleepers], dtype=np.uint32))
+
+    visibility = game.visibility
+    target = visibility.cache_target or (0, 0)
+    writer.pack(SIGHT, visibility.cache_target is not None, *target, len(visibility.cache))
+    writer.chunks.extend(SIGHT_TILE.pack(tile[0], tile[1], seen) for tile, seen in visibility.cache.items())
+
+    swarm = game.swarm
+    writer.pack(COUNT, swarm is not None)
+    if swarm is not None:
+        state = swarm.rng.bit_generator.state
+        pcg = state['state']
+        writer.pack(SWARM, swarm.capacity, swarm.count, len(swarm.free), pcg['state'] >> 64, pcg['state'] & _MASK_64,
+                    pcg['inc'] >> 64, pcg['inc'] & _MASK_64, state['has_uint32'], state['uinteger'])
+        # Like the bullets, only the live slots are written
+        live = np.flatnonzero(swarm.alive)
+        writer.array(live.astype(np.uint32))
+        for name in SWARM_ARRAYS:
+            writer.array(getattr(swarm, name)[live])
+        writer.array(np.asarray(swarm.free, dtype=np.uint32))
+
+    return writer.getvalue()
+
+
+def _clear_level(game):
+    # Drops every enemy and collectable and starts over with empty timers, regions and swarm, without reloading the
+    # level around them
+    for sprite in game.enemies.sprites() + game.collectables.sprites():
+        sprite.kill()
+    game.scheduler = Scheduler()
+    if game.batched_ai:
+        game.swarm = EnemySwarm(game)
+    game.regions = RegionMap(game, game.region_tiles * game.tile_size, game.wake_margin)
+
+
+def restore(game, data):
+    # Puts the game back to where it was when data was taken. The game has to be playing the same set of levels with
+    # the same settings, but it can be on any level, or even a different Game object.
+    reader = _Reader(data)
+    (magic, version, seed, tick_count, now, accumulator, level, camera_x, camera_y,
+     level_clears) = reader.unpack(HEADER)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'not a version {VERSION} game snapshot')
+
+    if game.level_manager.current_level != level:
+        game.level_manager.current_level = level
+        game.play_level()
+    _clear_level(game)
+
+    game.seed = seed
+    game.tick_count = tick_count
+    game.clock.now = now
+    game.timestep.accumulator = accumulator
+    game.level_ticks = reader.array(np.uint64, (level_clears,)).tolist()
+
+    # Set last, the constructors below draw from it
+    rng = reader.unpack(RNG)
+
+    (x, y, w, h, rotation, health, max_health, damage, can_shoot, last_shot, hit_state, hit_state_start, score,
+     shots_fired, damage_taken, collectables_picked) = reader.unpack(PLAYER)
+    player = game.player
+    player.rotation = rotation
+    player.health = health
+    player.max_health = max_health
+    player.damage = damage
+    player.can_shoot = bool(can_shoot)
+    player.last_shot = last_shot
+    player.hit_state = bool(hit_state)
+    player.hit_state_start = hit_state_start
+    player.score = score
+    player.shots_fired = shots_fired
+    player.damage_taken = damage_taken
+    player.collectables_picked = collectables_picked
+    player.image = player.rotations.get('hit' if player.hit_state else 'normal', rotation)
+    player.rect = player.image.get_rect()
+    player.rect.update(x, y, w, h)
+
+    # The constructors do the setup every enemy and collectable needs. Whatever they scheduled, picked at random or
+    # put in a swarm slot is overwritten straight after.
+    sprites = [player]
+    count, = reader.unpack(COUNT)
+    for (x, y, health, hit_state, hit_state_start, hit_state_end, last_action, action_timer, rand_moving, chasing,
+         asleep, move_x, move_y, slot) in reader.records(ENEMY, count):
+        enemy = Enemy(game, x, y)
+        enemy.health = health
+        enemy.hit_state = bool(hit_state)
+        enemy.hit_state_start = hit_state_start
+        enemy.hit_state_end = None if hit_state_end < 0 else hit_state_end
+        enemy.last_action = last_action
+        enemy.action_timer = action_timer
+        enemy.rand_moving = bool(rand_moving)
+        enemy.chasing = bool(chasing)
+        enemy.asleep = bool(asleep)
+        enemy.move_dir = (move_x, move_y)
+        enemy.slot = None if slot < 0 else slot
+        enemy.image = enemy.hit_img if enemy.hit_state else enemy.orig_img
+        enemy.next_action = None
+        enemy.end_hit = None
+        sprites.append(enemy)
+
+    count, = reader.unpack(COUNT)
+    for x, y, reward_health, reward_damage in reader.records(COLLECTABLE, count):
+        item = Collectable(game, x, y)
+        item.reward_health = reward_health
+        item.reward_damage = reward_damage
+        sprites.append(item)
+
+    for group, ids in ((game.entities, reader.ids()), (game.active, reader.ids())):
+        group.empty()
+        group.add(*[sprites[index] for index in ids])
+
+    scheduler = game.scheduler
+    sequence, fired, count = reader.unpack(SCHEDULER)
+    # The timers were written in the order they fire, and a sorted list is already a valid heap
+    scheduler.queue = []
+    for when, timer_sequence, owner, callback in reader.records(TIMER, count):
+        sprite = sprites[owner]
+        name = CALLBACKS[callback]
+        timer = Timer(when, getattr(sprite, name))
+        scheduler.queue.append((when, timer_sequence, timer))
+        if sprite is not player:
+            if name == '_act':
+                sprite.next_action = timer
+            else:
+                sprite.end_hit = timer
+    scheduler.sequence = sequence
+    scheduler.fired = fired
+
+    bullets = game.bullets
+    capacity, next_serial, count, free = reader.unpack(BULLETS)
+    live = reader.array(np.uint32, (count,)).astype(np.intp)
+    for name, shape in (('pos', (capacity, 2)), ('prev', (capacity, 2)), ('vel', (capacity, 2)), ('damage', capacity),
+                        ('target', capacity), ('serial', capacity)):
+        array = np.zeros(shape, dtype=getattr(bullets, name).dtype)
+        array[live] = reader.array(array.dtype, (count,) + array.shape[1:])
+        setattr(bullets, name, array)
+    bullets.alive = np.zeros(capacity, dtype=bool)
+    bullets.alive[live] = True
+    bullets.free = reader.array(np.uint32, (free,)).tolist()
+    bullets.capacity = capacity
+    bullets.next_serial = next_serial
+    bullets.count = count
+
+    regions = game.regions
+    has_bounds, first_col, first_row, last_col, last_row, sleeps, wakes, count = reader.unpack(REGIONS)
+    regions.bounds = (first_col, first_row, last_col, last_row) if has_bounds else None
+    regions.sleeps = sleeps
+    regions.wakes = wakes
+    for _ in range(count):
+        col, row, sleepers = reader.unpack(REGION)
+        regions.sleepers[(col, row)] = [sprites[index] for index in reader.array(np.uint32, (sleepers,)).tolist()]
+
+    visibility = game.visibility
+    has_target, target_col, target_row, count = reader.unpack(SIGHT)
+    visibility.cache_target = (target_col, target_row) if has_target else None
+    visibility.cache = {(col, row): bool(seen) for col, row, seen in reader.records(SIGHT_TILE, count)}
+
+    has_swarm, = reader.unpack(COUNT)
+    if bool(has_swarm) != (game.swarm is not None):
+        raise ValueError('snapshot and game disagree on batched_ai')
+    if has_swarm:
+        swarm = game.swarm
+        (capacity, count, free, state_high, state_low, inc_high, inc_low, has_uint32,
+         uinteger) = reader.unpack(SWARM)
+        live = reader.array(np.uint32, (count,)).astype(np.intp)
+        for name in SWARM_ARRAYS:
+            array = np.zeros((capacity,) + getattr(swarm, name).shape[1:], dtype=getattr(swarm, name).dtype)
+            array[live] = reader.array(array.dtype, (count,) + array.shape[1:])
+            setattr(swarm, name, array)
+        swarm.alive = np.zeros(capacity, dtype=bool)
+        swarm.alive[live] = True
+        swarm.free = reader.array(np.uint32, (free,)).tolist()
+        swarm.capacity = capacity
+        swarm.count = count
+        swarm.sprites = [None] * capacity
+        for enemy in sprites:
+            if isinstance(enemy, Enemy) and enemy.slot is not None:
+                swarm.sprites[enemy.slot] = enemy
+        swarm.rng.bit_generator.state = {
+            'bit_generator': 'PCG64',
+            'state': {'state': (state_high << 64) | state_low, 'inc': (inc_high << 64) | inc_low},
+            'has_uint32': has_uint32,
+            'uinteger': uinteger,
+        }
+
+    game.rng.setstate((3, tuple(rng[:625]), rng[626] if rng[625] else None))
+    game.camera.view.topleft = (camera_x, camera_y)
+    # Whatever was on screen before is stale, so the next frame redraws the whole play area
+    game.background_view = None
@@ -0,0 +1,149 @@
+import numpy as np
+
+
+class TileGrid(object):
+    # Static occupancy index over the level tile map. Each cell holds the rects of the static colliders
+    # overlapping it, so a collision check only looks at the handful of tiles a rect covers instead of every wall.
+    def __init__(self, width, height, tile_size):
+        self.tile_size = tile_size
+        self.cols = -(-width // tile_size)
+        self.rows = -(-height // tile_size)
+        self.cells = [[[] for _ in range(self.cols)] for _ in range(self.rows)]
+        self.rects = []
+        # Which tiles have a collider in them as a (rows, cols) bool array, and its summed-area table. Built when first
+        # asked for after the colliders change, see blocked_tiles().
+        self._blocked = None
+        self._counts = None
+
+    def add(self, rect):
+        self.rects.append(rect)
+        for col, row in self.tiles_overlapping(rect):
+            self.cells[row][col].append(rect)
+        self._blocked = None
+        self._counts = None
+
+    def blocked_tiles(self):
+        if self._blocked is None:
+            self._blocked = np.fromiter(
+                (bool(cell) for row in self.cells for cell in row), dtype=bool, count=self.rows * self.cols
+            ).reshape(self.rows, self.cols)
+            self._counts = np.zeros((self.rows + 1, self.cols + 1), dtype=np.int32)
+            self._counts[1:, 1:] = self._blocked.cumsum(axis=0).cumsum(axis=1)
+        return self._blocked
+
+    def tile_spans(self, left, top, right, bottom):
+        # tiles_overlapping for arrays of boxes at once: the first and last col and row each box covers, clipped to
+        # the grid. A box that's off the grid gets a last col or row before its first.
+        # np.minimum and np.maximum rather than np.clip, which costs more than the rest of this put together
+        ts = self.tile_size
+        first_col = np.minimum(np.maximum(np.floor_divide(left, ts).astype(np.int64), 0), self.cols)
+        last_col = np.minimum(np.maximum(np.floor_divide(right - 1, ts).astype(np.int64), -1), self.cols - 1)
+        first_row = np.minimum(np.maximum(np.floor_divide(top, ts).astype(np.int64), 0), self.rows)
+        last_row = np.minimum(np.maximum(np.floor_divide(bottom - 1, ts).astype(np.int64), -1), self.rows - 1)
+        return first_col, last_col, first_row, last_row
+
+    def spans_blocked(self, first_col, last_col, first_row, last_row):
+        # Whether any tile in each span from tile_spans has a collider in it, four lookups per span
+        self.blocked_tiles()
+        counts = self._counts
+        walls = (
+            counts[last_row + 1, last_col + 1] - counts[first_row, last_col + 1]
+            - counts[last_row + 1, first_col] + counts[first_row, first_col]
+        )
+        return (first_col <= last_col) & (first_row <= last_row) & (walls > 0)
+
+    def span_cells(self, first_col, last_col, first_row, last_row):
+        # Every tile in each span from tile_spans as two flat arrays: the row-major tile index and which span it came
+        # from. Spans that are off the grid have no tiles.
+        widths = np.maximum(last_col - first_col + 1, 0)
+        counts = widths * np.maximum(last_row - first_row + 1, 0)
+        spans = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(spans)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cols = first_col[spans] + offsets % np.maximum(widths[spans], 1)
+        rows = first_row[spans] + offsets // np.maximum(widths[spans], 1)
+        return rows * self.cols + cols, spans
+
+    def tile_at(self, x, y):
+        return int(x // self.tile_size), int(y // self.tile_size)
+
+    def in_bounds(self, col, row):
+        return 0 <= col < self.cols and 0 <= row < self.rows
+
+    def is_blocked(self, col, row):
+        return self.in_bounds(col, row) and bool(self.cells[row][col])
+
+    def tiles_overlapping(self, rect):
+        # Rect edges are exclusive on the right and bottom, the same as pg.Rect.colliderect
+        if rect.width <= 0 or rect.height <= 0:
+            return
+        ts = self.tile_size
+        first_col = max(rect.left // ts, 0)
+        last_col = min((rect.right - 1) // ts, self.cols - 1)
+        first_row = max(rect.top // ts, 0)
+        last_row = min((rect.bottom - 1) // ts, self.rows - 1)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                yield col, row
+
+    def collides(self, rect):
+        # The same tiles as tiles_overlapping, written out because every moving entity calls this twice a tick
+        if rect.width <= 0 or rect.height <= 0:
+            return False
+        ts = self.tile_size
+        first_col = max(rect.left // ts, 0)
+        last_col = min((rect.right - 1) // ts, self.cols - 1)
+        first_row = max(rect.top // ts, 0)
+        last_row = min((rect.bottom - 1) // ts, self.rows - 1)
+        cells = self.cells
+        for row in range(first_row, last_row + 1):
+            row_cells = cells[row]
+            for col in range(first_col, last_col + 1):
+                cell = row_cells[col]
+                if cell and rect.collidelist(cell) >= 0:
+                    return True
+        return False
+
+
+def merge_tiles(tiles):
+    # Greedily covers a set of (col, row) tiles with as few rectangles as it can. Each rectangle starts at the first
+    # uncovered tile in reading order, grows right as far as it can and then down while the whole row below is free.
+    # Returns (col, row, width, height) tuples in tiles.
+    remaining = set(tiles)
+    merged = []
+    for col, row in sorted(tiles, key=lambda tile: (tile[1], tile[0])):
+        if (col, row) not in remaining:
+            continue
+        width = 1
+        while (col + width, row) in remaining:
+            width += 1
+        height = 1
+        while all((c, row + height) in remaining for c in range(col, col + width)):
+            height += 1
+        for r in range(row, row + height):
+            for c in range(col, col + width):
+                remaining.discard((c, r))
+        merged.append((col, row, width, height))
+    return merged
+
+
+def segment_entry(x0, y0, dx, dy, rect):
+    # Slab test of the segment (x0, y0) + t * (dx, dy), 0 <= t <= 1, against the inside of rect.
+    # Returns the t where the segment enters the rect, or None if it misses or only grazes an edge.
+    t_enter = 0.0
+    t_exit = 1.0
+    for p, d, low, high in ((x0, dx, rect.left, rect.right), (y0, dy, rect.top, rect.bottom)):
+        if d == 0:
+            if p <= low or p >= high:
+                return None
+            continue
+        t_low = (low - p) / d
+        t_high = (high - p) / d
+        if t_low > t_high:
+            t_low, t_high = t_high, t_low
+        if t_low > t_enter:
+            t_enter = t_low
+        if t_high < t_exit:
+            t_exit = t_high
+        if t_enter >= t_exit:
+            return None
+    return t_enter
@@ -0,0 +1,225 @@
+import numpy as np
+import pygame as pg
+
+from bullets import TARGET_PLAYER
+
+
+class EnemySwarm(object):
+    # Batched enemy AI. Each enemy is a slot in a set of arrays holding its position, state, timers and move direction,
+    # and one vectorized pass per tick decides for every enemy whose action timer is due and moves all of them. The
+    # Enemy sprites stay around to be drawn, collided with and hit, but aren't in the game's active group.
+    def __init__(self, game, capacity=256):
+        self.game = game
+        # Wander decisions are drawn in bulk, from a generator seeded off the game's RNG so runs still replay exactly
+        self.rng = np.random.default_rng(game.rng.getrandbits(64))
+
+        self.capacity = 0
+        self.pos = np.zeros((0, 2), dtype=np.int64)
+        self.size = np.zeros((0, 2), dtype=np.int64)
+        self.move_dir = np.zeros((0, 2), dtype=np.float64)
+        self.speed = np.zeros(0, dtype=np.float64)
+        self.sight_range = np.zeros(0, dtype=np.float64)
+        self.attack_range = np.zeros(0, dtype=np.float64)
+        self.rand_action_chance = np.zeros(0, dtype=np.float64)
+        self.next_action = np.zeros(0, dtype=np.int64)
+        self.action_timer = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.hit = np.zeros(0, dtype=bool)
+        self.asleep = np.zeros(0, dtype=bool)
+        self.rand_moving = np.zeros(0, dtype=bool)
+        self.chasing = np.zeros(0, dtype=bool)
+        self.sprites = []
+        self.free = []
+        self.count = 0
+
+        # Per tile centre of the next tile along the flow field, rebuilt whenever the field is
+        self.flow_field = None
+        self.flow_rebuilds = -1
+        self.flow_goals = None
+
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, capacity):
+        old = self.capacity
+        for name in ('pos', 'size', 'move_dir'):
+            setattr(self, name, np.resize(getattr(self, name), (capacity, 2)))
+        for name in ('speed', 'sight_range', 'attack_range', 'rand_action_chance', 'next_action', 'action_timer',
+                     'alive', 'hit', 'asleep', 'rand_moving', 'chasing'):
+            setattr(self, name, np.resize(getattr(self, name), capacity))
+        self.alive[old:] = False
+        self.sprites.extend([None] * (capacity - old))
+        # Hand out the lowest slots first
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def add(self, enemy):
+        if not self.free:
+            self._grow(self.capacity * 2)
+        slot = self.free.pop()
+        self.pos[slot] = enemy.rect.topleft
+        self.size[slot] = enemy.rect.size
+        self.move_dir[slot] = enemy.move_dir
+        self.speed[slot] = enemy.speed
+        self.sight_range[slot] = enemy.sight_range
+        self.attack_range[slot] = enemy.attack_range
+        self.rand_action_chance[slot] = enemy.rand_action_chance
+        self.next_action[slot] = enemy.last_action + enemy.action_timer
+        self.action_timer[slot] = enemy.action_timer
+        self.alive[slot] = True
+        self.hit[slot] = enemy.hit_state
+        self.asleep[slot] = False
+        self.rand_moving[slot] = enemy.rand_moving
+        self.chasing[slot] = enemy.chasing
+        self.sprites[slot] = enemy
+        self.count += 1
+        return slot
+
+    def remove(self, slot):
+        self.alive[slot] = False
+        self.sprites[slot] = None
+        self.free.append(slot)
+        self.count -= 1
+
+    def centers(self, slots):
+        # The same as each sprite's rect.center
+        return self.pos[slots] + self.size[slots] // 2
+
+    def update(self):
+        now = self.game.clock.get_ticks()
+        # Enemies in their hit state don't do anything, and catch up on a missed decision as soon as they recover.
+        # Sleeping enemies don't do anything either.
+        live = self.alive & ~self.hit & ~self.asleep
+
+        due = np.flatnonzero(live & (self.next_action <= now))
+        if len(due):
+            self._decide(due, now)
+
+        chasing = np.flatnonzero(live & self.chasing)
+        if len(chasing):
+            self._steer(chasing)
+
+        moving = np.flatnonzero(live & self.rand_moving)
+        if len(moving):
+            self._move(moving)
+
+    def _decide(self, slots, now):
+        game = self.game
+        player_center = game.player.rect.center
+        self.next_action[slots] = now + self.action_timer[slots]
+
+        centers = self.centers(slots)
+        offset = np.asarray(player_center, dtype=np.float64) - centers
+        distance = np.hypot(offset[:, 0], offset[:, 1])
+
+        # The attack range is inside the sight range, so a single line of sight check covers both. Line of sight is
+        # still one raycast per enemy, but only for the ones that are due and close enough.
+        visible = np.zeros(len(slots), dtype=bool)
+        for i in np.flatnonzero(distance <= self.sight_range[slots]).tolist():
+            visible[i] = game.visibility.can_see(tuple(centers[i].tolist()), player_center)
+
+        shoot = visible & (distance <= self.attack_range[slots])
+        shooters = slots[shoot]
+        self.rand_moving[shooters] = False
+        self.chasing[shooters] = False
+        for i in np.flatnonzero(shoot & (distance > 0)).tolist():
+            enemy = self.sprites[slots[i]]
+            direction = (offset[i] / distance[i]).tolist()
+            game.bullets.spawn(
+                centers[i, 0], centers[i, 1], direction, enemy.bullet_speed, enemy.bullet_damage, TARGET_PLAYER
+            )
+
+        chase = slots[visible & ~shoot]
+        self.rand_moving[chase] = True
+        self.chasing[chase] = True
+
+        # If the player went out of sight but is still close by walking distance, keep after them
+        unseen = slots[~visible]
+        for slot in unseen[self.chasing[unseen]].tolist():
+            path = game.flow_field.path_length(tuple(self.centers(slot).tolist()), player_center)
+            if path is None or path > self.sight_range[slot]:
+                self.chasing[slot] = False
+
+        # Everyone else maybe starts or stops wandering in a random direction
+        wander = unseen[~self.chasing[unseen]]
+        roll = self.rng.random(len(wander))
+        directions = self.rng.integers(-1, 2, size=(len(wander), 2))
+        chance = self.rand_action_chance[wander]
+        still = ~self.rand_moving[wander]
+        start = still & (roll >= chance)
+        stop = ~still & (roll < chance)
+        self.move_dir[wander[start]] = directions[start]
+        self.rand_moving[wander[start]] = True
+        self.rand_moving[wander[stop]] = False
+
+    def _flow_goals(self, flow_field):
+        if flow_field is not self.flow_field or flow_field.rebuilds != self.flow_rebuilds:
+            ts = flow_field.grid.tile_size
+            half = ts / 2
+            goals = np.full((len(flow_field.next_tile), 2), np.nan)
+            for index, step in enumerate(flow_field.next_tile):
+                if step is not None:
+                    goals[index] = (step[0] * ts + half, step[1] * ts + half)
+            self.flow_field = flow_field
+            self.flow_rebuilds = flow_field.rebuilds
+            self.flow_goals = goals
+        return self.flow_goals
+
+    def _steer(self, slots):
+        # FlowField.steer for all the chasing enemies at once
+        game = self.game
+        player_center = game.player.rect.center
+        flow_field = game.flow_field
+        flow_field.update(player_center)
+        goals = self._flow_goals(flow_field)
+        grid = flow_field.grid
+
+        centers = self.centers(slots)
+        col = centers[:, 0] // grid.tile_size
+        row = centers[:, 1] // grid.tile_size
+        inside = (col >= 0) & (col < grid.cols) & (row >= 0) & (row < grid.rows)
+        at_target = ~inside
+        if flow_field.target is not None:
+            at_target |= (col == flow_field.target[0]) & (row == flow_field.target[1])
+
+        index = np.where(inside, row * grid.cols + col, 0)
+        goal = goals[index]
+        goal[at_target] = player_center
+
+        offset = goal - centers
+        length = np.hypot(offset[:, 0], offset[:, 1])
+        # No way through (nan) or already there (0) means standing still
+        ok = np.isfinite(length) & (length > 0)
+        direction = np.zeros((len(slots), 2))
+        direction[ok] = offset[ok] / length[ok, None]
+        self.move_dir[slots] = direction
+
+    def _blocked(self, left, top, width, height):
+        # Whether each rect hits a wall, tested against the same colliders Entity.move uses. The wall tile map only
+        # narrows it down: a rect that doesn't overlap a tile with a collider in it can't hit anything.
+        wall_grid = self.game.wall_grid
+        blocked = np.zeros(len(left), dtype=bool)
+        spans = wall_grid.tile_spans(left, top, left + width, top + height)
+        for i in np.flatnonzero(wall_grid.spans_blocked(*spans)).tolist():
+            blocked[i] = wall_grid.collides(pg.Rect(int(left[i]), int(top[i]), int(width[i]), int(height[i])))
+        return blocked
+
+    def _move(self, slots):
+        # Entity.move for all the moving enemies at once: each axis in turn, undoing the step if it hits a wall.
+        # Positions stay whole pixels, truncated the same way assigning to a rect does.
+        pos = self.pos[slots]
+        size = self.size[slots]
+        velocity = self.move_dir[slots] * self.speed[slots, None]
+        for axis in (0, 1):
+            start = pos[:, axis].copy()
+            pos[:, axis] = np.trunc(start + velocity[:, axis]).astype(np.int64)
+            blocked = self._blocked(pos[:, 0], pos[:, 1], size[:, 0], size[:, 1])
+            pos[blocked, axis] = start[blocked]
+
+        changed = np.any(pos != self.pos[slots], axis=1)
+        self.pos[slots] = pos
+        sprites = self.sprites
+        for slot, x, y in zip(slots[changed].tolist(), pos[changed, 0].tolist(), pos[changed, 1].tolist()):
+            sprites[slot].rect.topleft = (x, y)
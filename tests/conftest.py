@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Assets and levels are found relative to the working directory, the same as when the game is run from the repo
+os.chdir(ROOT)
@@ -0,0 +1,122 @@
+import math
+import random
+
+import numpy as np
+import pygame as pg
+import pytest
+
+import bullets as bullets_module
+from bots import ARROWS, nearest_enemy
+from bullets import TARGET_ENEMY
+from headless import make_game
+from simulation import InputState, ScriptedInput, SimulatedClock
+from spatial import segment_entry
+
+
+def bot(frame, game):
+    # Wanders and shoots at the nearest enemy. It keeps no state of its own, so a restored game plays on the same.
+    rng = random.Random(game.tick_count // 15)
+    keys = [key for key in ARROWS if rng.random() < 0.3]
+    target = nearest_enemy(game) or (0, 0)
+    return InputState(keys, game.camera.to_screen(target), (True, False, False))
+
+
+def new_game(seed, batched_ai=False):
+    game = make_game(ScriptedInput(bot), seed)
+    game.batched_ai = batched_ai
+    game.new_game()
+    return game
+
+
+def play_at(fps, ticks, seed):
+    # Plays ticks ticks the way the game loop does at fps frames per second, drawing after every frame
+    game = new_game(seed)
+    frame_clock = SimulatedClock()
+    while game.tick_count < ticks:
+        game.clear_world()
+        for _ in range(game.timestep.advance(frame_clock.tick(fps))):
+            if game.tick_count >= ticks or not game.step_tick():
+                return game
+        game.draw_world()
+    return game
+
+
+def test_same_result_at_any_frame_rate():
+    results = set()
+    for fps in (12, 30, 60, 144):
+        game = play_at(fps, 600, seed=7)
+        # The part of a frame left over in the timestep depends on the frame rate, everything else mustn't
+        game.timestep.reset()
+        results.add(game.save_state())
+    assert len(results) == 1
+
+
+@pytest.mark.parametrize('batched_ai', [False, True])
+def test_snapshot_round_trip(batched_ai):
+    game = new_game(5, batched_ai)
+    game.simulate(400)
+    saved = game.save_state()
+    assert game.save_state() == saved
+
+    game.simulate(300)
+    expected = game.save_state()
+
+    # Restoring into the same game and into a fresh one both carry on exactly as the original did
+    game.load_state(saved)
+    game.simulate(300)
+    assert game.save_state() == expected
+
+    fresh = make_game(ScriptedInput(bot), 5)
+    fresh.batched_ai = batched_ai
+    fresh.load_state(saved)
+    fresh.simulate(300)
+    assert fresh.save_state() == expected
+
+
+def grown(rect, manager):
+    # rect grown by the bullet size, so a bullet can be tested as the path of its top left corner
+    return pg.Rect(rect.left - manager.width, rect.top - manager.height,
+                   rect.width + manager.width, rect.height + manager.height)
+
+
+@pytest.mark.parametrize('broad_phase_pairs', [0, math.inf])
+def test_sweeps_match_segment_entry(monkeypatch, broad_phase_pairs):
+    # Checks wall_entry and reaching against segment_entry one bullet and rect at a time, with and without the broad
+    # phase binning
+    monkeypatch.setattr(bullets_module, 'BROAD_PHASE_PAIRS', broad_phase_pairs)
+    game = new_game(3)
+    manager = game.bullets
+    rng = random.Random(3)
+    world = game.world_rect
+    for _ in range(500):
+        angle = rng.uniform(0, 2 * math.pi)
+        manager.spawn(rng.uniform(world.left, world.right), rng.uniform(world.top, world.bottom),
+                      (math.cos(angle), math.sin(angle)), rng.uniform(0, 40), 1, TARGET_ENEMY)
+    manager.update()
+    rects = [enemy.rect for enemy in game.enemies]
+    rects += [pg.Rect(rng.randrange(world.width), rng.randrange(world.height), rng.randrange(1, 80),
+                      rng.randrange(1, 80)) for _ in range(100)]
+
+    slots = manager.active()
+    entry = manager.wall_entry()
+    reached = manager.reaching(rects, slots, entry)
+    # Enough bullets to hit both walls and rects
+    assert np.isfinite(entry).any()
+    assert any(len(found) for found in reached)
+
+    x0, y0, dx, dy = manager.sweep(slots)
+    expected_entry = {}
+    for i, slot in enumerate(slots.tolist()):
+        hits = [segment_entry(int(x0[i]), int(y0[i]), int(dx[i]), int(dy[i]), grown(rect, manager))
+                for rect in game.wall_grid.rects]
+        hits = [t for t in hits if t is not None]
+        expected_entry[slot] = min(hits) if hits else math.inf
+        assert entry[slot] == pytest.approx(expected_entry[slot])
+
+    for rect, found in zip(rects, reached):
+        expected = []
+        for i, slot in enumerate(slots.tolist()):
+            t = segment_entry(int(x0[i]), int(y0[i]), int(dx[i]), int(dy[i]), grown(rect, manager))
+            if t is not None and t <= expected_entry[slot]:
+                expected.append(slot)
+        assert list(found) == expected
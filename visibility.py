@@ -0,0 +1,90 @@
+from spatial import segment_entry
+
+
+class Visibility(object):
+    # Line of sight over the level tile map. Rays are walked tile by tile with a grid traversal (DDA), so a check
+    # only visits the tiles the segment actually crosses and never misses a wall between two samples.
+    def __init__(self, grid, cache=False):
+        self.grid = grid
+        self.cache_enabled = cache
+        self.cache = {}
+        self.cache_target = None
+
+        self.casts = 0
+        self.cache_hits = 0
+
+    def invalidate(self):
+        self.cache.clear()
+        self.cache_target = None
+
+    def raycast(self, start, end):
+        # Returns True if nothing on the grid blocks the segment from start to end
+        self.casts += 1
+        grid = self.grid
+        ts = grid.tile_size
+        x0, y0 = start
+        x1, y1 = end
+        dx = x1 - x0
+        dy = y1 - y0
+
+        col, row = grid.tile_at(x0, y0)
+        end_col, end_row = grid.tile_at(x1, y1)
+
+        if dx > 0:
+            step_col = 1
+            t_max_x = ((col + 1) * ts - x0) / dx
+            t_delta_x = ts / dx
+        elif dx < 0:
+            step_col = -1
+            t_max_x = (col * ts - x0) / dx
+            t_delta_x = -ts / dx
+        else:
+            step_col = 0
+            t_max_x = t_delta_x = float('inf')
+
+        if dy > 0:
+            step_row = 1
+            t_max_y = ((row + 1) * ts - y0) / dy
+            t_delta_y = ts / dy
+        elif dy < 0:
+            step_row = -1
+            t_max_y = (row * ts - y0) / dy
+            t_delta_y = -ts / dy
+        else:
+            step_row = 0
+            t_max_y = t_delta_y = float('inf')
+
+        # A segment crosses exactly one tile per column or row boundary it passes
+        for _ in range(abs(end_col - col) + abs(end_row - row) + 1):
+            if grid.in_bounds(col, row):
+                for rect in grid.cells[row][col]:
+                    if segment_entry(x0, y0, dx, dy, rect) is not None:
+                        return False
+
+            if t_max_x < t_max_y:
+                t_max_x += t_delta_x
+                col += step_col
+            else:
+                t_max_y += t_delta_y
+                row += step_row
+        return True
+
+    def can_see(self, start, end):
+        if not self.cache_enabled:
+            return self.raycast(start, end)
+
+        # The cache only holds results for a single target tile (the player). Once the target moves to another
+        # tile everything we know is stale, so start over.
+        start_tile = self.grid.tile_at(*start)
+        end_tile = self.grid.tile_at(*end)
+        if end_tile != self.cache_target:
+            self.cache.clear()
+            self.cache_target = end_tile
+
+        result = self.cache.get(start_tile)
+        if result is None:
+            result = self.raycast(start, end)
+            self.cache[start_tile] = result
+        else:
+            self.cache_hits += 1
+        return result